@@ -1,10 +1,126 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import wraps
 from io import BytesIO
 
 import requests
-from errors import handle_error_response
+from carts import MISSING, cart_cache
+from errors import ServerError, handle_error_response, strapi_policy
+from metrics import metrics
+from policy import remaining_time, request_timeout, settings
+
+
+logger = logging.getLogger(__name__)
+STRAPI_CONCURRENCY = 5
+CATALOG_PAGE_SIZE = 100
+PRODUCT_FIELDS = ("title", "price", "description", "updatedAt")
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            stats = self._stats.setdefault(func.__name__, [0, 0])
+            stats[0 if leader else 1] += 1
+        if not leader:
+            return self.wait(call)
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as error:
+            call.set_exception(error)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def wait(self, call):
+        timeout = remaining_time()
+        try:
+            return call.result(timeout=None if timeout is None else max(0, timeout))
+        except FutureTimeoutError:
+            raise ServerError("Ошибка запроса: исчерпан бюджет времени в ожидании общего запроса к Strapi") from None
+
+    def stats(self):
+        with self._lock:
+            return {name: {"calls": calls, "collapsed": collapsed} for name, (calls, collapsed) in self._stats.items()}
+
+    def render_stats(self):
+        lines = []
+        stats = self.stats()
+        for name in ("calls", "collapsed"):
+            metric = f"fish_shop_strapi_single_flight_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for function, values in stats.items():
+                lines.append(f'{metric}{{function="{function}"}} {values[name]}')
+        return lines
+
+
+single_flight = SingleFlight()
+metrics.add_collector(single_flight.render_stats)
+
+
+def shared_read(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        return single_flight.do(key, func, *args, **kwargs)
+
+    return wrapper
+
+
+def send_concurrently(session, calls, max_workers=STRAPI_CONCURRENCY):
+    if not calls:
+        return []
+    gather = getattr(session, "gather", None)
+    if gather is not None:
+        return gather(calls, limit=max_workers)
+
+    def send(call):
+        method, url, kwargs = call
+        try:
+            return session.request(method, url, **kwargs)
+        except Exception as error:
+            return error
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as executor:
+        return list(executor.map(send, calls))
+
+
+def run_concurrently(session, calls, handle, max_workers=STRAPI_CONCURRENCY):
+    results, errors = [], []
+    for response in send_concurrently(session, calls, max_workers):
+        if isinstance(response, BaseException):
+            errors.append(response)
+            continue
+        try:
+            results.append(handle(response))
+        except Exception as error:
+            errors.append(error)
+    return results, errors
+
+
+def check_response(response):
+    response.raise_for_status()
+
+
+def get_json(response):
+    response.raise_for_status()
+    return response.json()
 
 
-@handle_error_response
 def init_strapi_session(token):
     session = requests.Session()
     session.headers.update({
@@ -14,69 +130,135 @@ def init_strapi_session(token):
     return session
 
 
+def get_products_path(page, page_size=CATALOG_PAGE_SIZE, fields=PRODUCT_FIELDS, with_image=True, updated_since=None):
+    path = "/api/products?" + "&".join(f"fields[{index}]={field}" for index, field in enumerate(fields))
+    if with_image:
+        path += "&populate[image][fields][0]=formats"
+    if updated_since:
+        path += f"&filters[updatedAt][$gte]={updated_since}"
+    return f"{path}&pagination[page]={page}&pagination[pageSize]={page_size}"
+
+
+@shared_read
+@strapi_policy(idempotent=True)
 @handle_error_response
-def get_products(session, api_url):
-    response = session.get(f"{api_url}/api/products?populate=*", timeout=5)
+def get_products_page(session, api_url, path):
+    response = session.get(f"{api_url}{path}", timeout=request_timeout())
     response.raise_for_status()
-    products = {item["id"]: item for item in response.json().get("data", [])}
-    return products
+    return response.json()
+
+
+def iter_products(session, api_url, page_size=CATALOG_PAGE_SIZE, **query):
+    first_page = get_products_page(session, api_url, get_products_path(1, page_size, **query))
+    yield from first_page.get("data", [])
+    page_count = first_page.get("meta", {}).get("pagination", {}).get("pageCount", 1)
+    if page_count <= 1:
+        return
+    paths = tuple(get_products_path(page, page_size, **query) for page in range(2, page_count + 1))
+    for page in get_products_pages(session, api_url, paths):
+        yield from page.get("data", [])
+
 
+@shared_read
+@strapi_policy(idempotent=True)
+@handle_error_response
+def get_products_pages(session, api_url, paths):
+    calls = [("GET", f"{api_url}{path}", {"timeout": request_timeout()}) for path in paths]
+    pages, errors = run_concurrently(session, calls, get_json)
+    if errors:
+        raise errors[0]
+    return pages
+
+
+def get_products(session, api_url):
+    return {item["id"]: item for item in iter_products(session, api_url)}
+
+
+def get_product_ids(session, api_url):
+    return {item["id"] for item in iter_products(session, api_url, fields=("updatedAt",), with_image=False)}
 
+
+@strapi_policy(idempotent=True)
 @handle_error_response
 def get_image(session, api_url, url_image):
     url = f"{api_url}{url_image}"
-    response = session.get(url, stream=True, timeout=5)
+    response = session.get(url, stream=True, timeout=request_timeout())
     response.raise_for_status()
     return BytesIO(response.content)
 
 
-@handle_error_response
 def get_or_create_user_cart(session, api_url, user_id):
-    cart_response = session.get(f"{api_url}/api/carts?filters[telegramId][$eq]={user_id}", timeout=5)
-    cart_response.raise_for_status()
-    cart_data = cart_response.json()
+    if get_user_cart_with_items(session, api_url, user_id):
+        return
+    create_user_cart(session, api_url, user_id)
+
+
+@strapi_policy()
+@handle_error_response
+def create_user_cart(session, api_url, user_id):
+    payload = {"data": {"telegramId": user_id}}
+    create_response = session.post(f"{api_url}/api/carts", json=payload, timeout=request_timeout())
+    create_response.raise_for_status()
+    cart_cache.put(user_id, {**create_response.json()["data"], "cart_items": []})
 
-    if cart_data["meta"]["pagination"]["total"] == 0:
-        payload = {"data": {"telegramId": user_id}}
-        create_response = session.post(f"{api_url}/api/carts", json=payload)
-        create_response.raise_for_status()
 
+def get_user_cart_with_items(session, api_url, user_id, use_cache=True):
+    if not use_cache:
+        return fetch_user_cart(session, api_url, user_id)
+    cached_cart = cart_cache.get(user_id)
+    if cached_cart is not MISSING:
+        return cached_cart
+    return single_flight.do(("fetch_user_cart", session, api_url, str(user_id)), fetch_user_cart, session, api_url, user_id)
 
+
+@strapi_policy(idempotent=True)
 @handle_error_response
-def get_user_cart_with_items(session, api_url, user_id):
-    response = session.get(f"{api_url}/api/carts?filters[telegramId][$eq]={user_id}&populate=cart_items.product", timeout=5)
+def fetch_user_cart(session, api_url, user_id):
+    response = session.get(f"{api_url}/api/carts?filters[telegramId][$eq]={user_id}&populate=cart_items.product", timeout=request_timeout())
     response.raise_for_status()
     data = response.json()
     if data.get("meta", {}).get("pagination", {}).get("total", 0) == 0:
+        cart_cache.put(user_id, None)
         return None
     cart_items = data.get("data", [])[0]
+    cart_cache.put(user_id, cart_items)
     return cart_items
 
 
+@strapi_policy()
 @handle_error_response
-def add_to_cart(session, api_url, product_id, user_id, quantity):
+def add_to_cart(session, api_url, product_id, user_id, quantity, product=None):
     cart = get_user_cart_with_items(session, api_url, user_id)
     cart_id = cart["id"]
     cart_items = cart.get("cart_items", [])
 
     existing_item = next((item for item in cart_items if item.get("product", {}).get("id") == int(product_id)), None)
 
-    if existing_item:
-        new_quantity = existing_item.get("quantity", 0) + quantity
-        update_payload = {"data": {"quantity": new_quantity}}
-        update_url = f"{api_url}/api/cart-items/{existing_item["documentId"]}"
-        response = session.put(update_url, json=update_payload)
-        response.raise_for_status()
-    else:
-        create_payload = {
-            "data": {
-                "quantity": quantity,
-                "cart_item": cart_id,
-                "product": product_id,
+    try:
+        if existing_item:
+            new_quantity = existing_item.get("quantity", 0) + quantity
+            update_payload = {"data": {"quantity": new_quantity}}
+            update_url = f"{api_url}/api/cart-items/{existing_item['documentId']}"
+            response = session.put(update_url, json=update_payload, timeout=request_timeout())
+            response.raise_for_status()
+            cart_cache.update_item(user_id, {**existing_item, "quantity": new_quantity})
+        else:
+            create_payload = {
+                "data": {
+                    "quantity": quantity,
+                    "cart_item": cart_id,
+                    "product": product_id,
+                }
             }
-        }
-        response = session.post(f"{api_url}/api/cart-items", json=create_payload )
-        response.raise_for_status()
+            response = session.post(f"{api_url}/api/cart-items", json=create_payload, timeout=request_timeout())
+            response.raise_for_status()
+            if product:
+                cart_cache.update_item(user_id, {**response.json()["data"], "product": product})
+            else:
+                cart_cache.invalidate(user_id)
+    except Exception:
+        cart_cache.invalidate(user_id)
+        raise
 
 
 def get_display_cart(cart):
@@ -98,29 +280,56 @@ def get_display_cart(cart):
     return {"cart_display": cart_display, "count_items": len(product_summaries)}
 
 
+@strapi_policy()
 @handle_error_response
-def remove_from_cart(session, api_url, cart_item_id):
-    response = session.get(f"{api_url}/api/cart-items?filters[id][$eq]={cart_item_id}", timeout=5)
-    response.raise_for_status()
-    cart_item_data = response.json()
+def remove_from_cart(session, api_url, cart_item_id, user_id=None):
+    indexed_item = cart_cache.find_item(cart_item_id)
+    if indexed_item:
+        owner_id, document_id = indexed_item
+    else:
+        response = session.get(f"{api_url}/api/cart-items?filters[id][$eq]={cart_item_id}", timeout=request_timeout())
+        response.raise_for_status()
+        cart_item_data = response.json()
+        owner_id, document_id = user_id, cart_item_data["data"][0]["documentId"]
 
-    document_id = cart_item_data["data"][0]["documentId"]
     delete_cart_item = f"{api_url}/api/cart-items/{document_id}"
-    del_response = session.delete(delete_cart_item)
+    del_response = session.delete(delete_cart_item, timeout=request_timeout())
     del_response.raise_for_status()
+    if owner_id is None:
+        cart_cache.invalidate()
+    else:
+        cart_cache.remove_item(owner_id, cart_item_id)
 
 
 
+def clear_user_cart(session, api_url, user_id, cart_items=None):
+    if cart_items is None:
+        cart = get_user_cart_with_items(session, api_url, user_id)
+        cart_items = cart.get("cart_items", []) if cart else []
+    if cart_items:
+        delete_cart_items(session, api_url, user_id, cart_items)
+
+
+@strapi_policy()
 @handle_error_response
-def clear_user_cart(session, api_url, user_id):
-    cart = get_user_cart_with_items(session, api_url, user_id)
-    if not cart:
-        return
-    cart_items = cart.get("cart_items", [])
+def delete_cart_items(session, api_url, user_id, cart_items):
+    def check_deleted(response):
+        if response.status_code != 404:
+            response.raise_for_status()
+
+    calls = [
+        ("DELETE", f"{api_url}/api/cart-items/{item['documentId']}", {"timeout": request_timeout()})
+        for item in cart_items
+    ]
+    _, errors = run_concurrently(session, calls, check_deleted)
+    if errors:
+        cart_cache.invalidate(user_id)
+        raise errors[0]
     for item in cart_items:
-        remove_from_cart(session, api_url, item["id"])
+        cart_cache.remove_item(user_id, item["id"])
 
 
+@strapi_policy()
 @handle_error_response
 def create_order(session, api_url, user_id, email, order_details):
     total = sum(item["product"]["price"] * item["quantity"] for item in order_details["cart_items"])
@@ -132,26 +341,54 @@ def create_order(session, api_url, user_id, email, order_details):
             "total": total
         }
     }
-    response = session.post(f"{api_url}/api/orders", json=order_upload)
+    response = session.post(f"{api_url}/api/orders", json=order_upload, timeout=request_timeout())
     response.raise_for_status()
-    order_id = response.json()["data"]["id"]
-    return create_order_items(session, api_url, order_id, product_items)
+    order = response.json()["data"]
+    try:
+        create_order_items(session, api_url, order["id"], product_items)
+    except Exception:
+        delete_order(session, api_url, order["documentId"])
+        raise
+    return order["documentId"]
 
 
+@strapi_policy()
 @handle_error_response
 def create_order_items(session, api_url, order_id, product_items):
-    upload_order_items = False
-    for item in product_items:
-        order_item_payload = {
-            "data": {
-                "quantity": item["quantity"],
-                "order": {"connect": order_id},
-                "product": {"connect": item["product"]}
-            }
-        }
-
-        response = session.post(f"{api_url}/api/order-items", json=order_item_payload)
+    def get_document_id(response):
         response.raise_for_status()
-        upload_order_items = True
-
-    return upload_order_items
+        return response.json()["data"]["documentId"]
+
+    calls = [
+        ("POST", f"{api_url}/api/order-items", {
+            "json": {
+                "data": {
+                    "quantity": item["quantity"],
+                    "order": {"connect": order_id},
+                    "product": {"connect": item["product"]}
+                }
+            },
+            "timeout": request_timeout(),
+        })
+        for item in product_items
+    ]
+    created_items, errors = run_concurrently(session, calls, get_document_id)
+    if errors:
+        rollback = [
+            ("DELETE", f"{api_url}/api/order-items/{document_id}", {"timeout": settings.timeout})
+            for document_id in created_items
+        ]
+        _, rollback_errors = run_concurrently(session, rollback, check_response)
+        for rollback_error in rollback_errors:
+            logger.error(f"Не удалось откатить элемент заказа {order_id}: {rollback_error}")
+        raise errors[0]
+
+    return bool(created_items)
+
+
+def delete_order(session, api_url, document_id):
+    try:
+        response = session.delete(f"{api_url}/api/orders/{document_id}", timeout=settings.timeout)
+        response.raise_for_status()
+    except requests.RequestException as error:
+        logger.error(f"Не удалось откатить заказ {document_id}: {error}")
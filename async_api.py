@@ -0,0 +1,119 @@
+import asyncio
+import json
+import threading
+
+import aiohttp
+import requests
+
+
+class AsyncStrapiClient:
+    def __init__(self, token, api_url, pool_size=20, timeout=5):
+        self.token = token
+        self.api_url = api_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = None
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers={
+                "Authorization": f"Bearer {self.token}",
+                "Content-Type": "application/json"
+            },
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+
+    async def fetch(self, method, url, timeout=None, **kwargs):
+        request_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        async with self.session.request(method, url, timeout=request_timeout, **kwargs) as response:
+            content = await response.read()
+            return response.status, response.reason, content
+
+
+class BridgeResponse:
+    def __init__(self, url, status_code, reason, content):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} {self.reason} for url: {self.url}", response=self)
+
+
+class StrapiBridge:
+    def __init__(self, client):
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.run(client.start())
+
+    def run(self, coroutine, timeout=None):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return future.result(timeout)
+
+    def request(self, method, url, **kwargs):
+        return self.run(self._send(method, url, **kwargs))
+
+    def gather(self, calls, limit=None):
+        return self.run(self._gather(calls, limit or len(calls)))
+
+    async def _gather(self, calls, limit):
+        semaphore = asyncio.Semaphore(limit)
+
+        async def send(method, url, kwargs):
+            async with semaphore:
+                return await self._send(method, url, **kwargs)
+
+        return await asyncio.gather(*(send(*call) for call in calls), return_exceptions=True)
+
+    async def _send(self, method, url, timeout=None, **kwargs):
+        kwargs.pop("stream", None)
+        try:
+            status_code, reason, content = await self.client.fetch(method, url, timeout=timeout, **kwargs)
+        except asyncio.TimeoutError as error:
+            raise requests.Timeout(f"Превышено время ожидания ответа: {url}") from error
+        except aiohttp.ClientConnectionError as error:
+            raise requests.ConnectionError(error) from error
+        except aiohttp.ClientError as error:
+            raise requests.RequestException(error) from error
+        return BridgeResponse(url, status_code, reason, content)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def init_async_strapi_session(token, api_url, pool_size=20, timeout=5):
+    client = AsyncStrapiClient(token, api_url, pool_size=pool_size, timeout=timeout)
+    return StrapiBridge(client)
@@ -0,0 +1,48 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from api import init_strapi_session
+from benchmarks.fake_strapi import FakeStrapi
+from catalog import CatalogCache
+from render import RenderCache
+
+
+def time_to_first_menu(strapi, snapshot_path):
+    session = init_strapi_session(token="benchmark")
+    catalog = CatalogCache(session, strapi.url, snapshot_path=snapshot_path)
+    started_at = time.perf_counter()
+    catalog.warm_up()
+    keyboard = RenderCache(catalog).menu_keyboard(0)
+    elapsed = time.perf_counter() - started_at
+    return elapsed, len(keyboard.inline_keyboard) > 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время до первого меню после запуска бота со снимком каталога и без него")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка ответа Strapi в секундах")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    snapshot_path = os.path.join(tempfile.mkdtemp(), "catalog_snapshot.json")
+    strapi = FakeStrapi(products=args.products, latency=args.latency).start()
+    results = []
+    try:
+        results.append(("strapi",) + time_to_first_menu(strapi, None))
+        time_to_first_menu(strapi, snapshot_path)
+        results.append(("snapshot",) + time_to_first_menu(strapi, snapshot_path))
+    finally:
+        strapi.stop()
+    results.append(("snapshot, strapi down",) + time_to_first_menu(strapi, snapshot_path))
+
+    print(f"Размер снимка: {os.path.getsize(snapshot_path) / 1024:.1f} КБ")
+    print(f"{'scenario':<24}{'ms':>10}{'menu':>8}")
+    for scenario, elapsed, has_menu in results:
+        print(f"{scenario:<24}{elapsed * 1000:>10.1f}{'да' if has_menu else 'нет':>8}")
+
+
+if __name__ == "__main__":
+    main()
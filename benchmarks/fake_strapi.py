@@ -0,0 +1,305 @@
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class FakeStrapi:
+    def __init__(self, products=50, latency=0.0, image_size=30 * 1024):
+        self.latency = latency
+        self.image_size = image_size
+        self.calls = Counter()
+        self.products = {}
+        self.carts = {}
+        self.cart_items = {}
+        self.orders = {}
+        self.order_items = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        for _ in range(products):
+            self.add_product()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def next_id(self):
+        return next(self._ids)
+
+    def add_product(self, title=None, price=None):
+        with self._lock:
+            product_id = self.next_id()
+            self.products[product_id] = {
+                "id": product_id,
+                "documentId": f"product{product_id}",
+                "title": title or f"Рыба №{product_id}",
+                "price": price or 100 + product_id,
+                "description": f"Описание рыбы №{product_id}",
+                "image": {
+                    "id": product_id,
+                    "url": f"/uploads/fish_{product_id}.jpg",
+                    "formats": {
+                        "thumbnail": {"url": f"/uploads/thumbnail_fish_{product_id}.jpg"},
+                        "small": {"url": f"/uploads/small_fish_{product_id}.jpg"},
+                    },
+                },
+                "createdAt": now_iso(),
+                "updatedAt": now_iso(),
+                "publishedAt": now_iso(),
+            }
+            return self.products[product_id]
+
+    def update_product(self, product_id, **changes):
+        with self._lock:
+            self.products[product_id].update(changes, updatedAt=now_iso())
+            return self.products[product_id]
+
+    def delete_product(self, product_id):
+        with self._lock:
+            return self.products.pop(product_id, None)
+
+    def seed_cart(self, user_id, items=0):
+        with self._lock:
+            cart = self.carts.get(str(user_id))
+            if not cart:
+                cart_id = self.next_id()
+                cart = {"id": cart_id, "documentId": f"cart{cart_id}", "telegramId": str(user_id)}
+                self.carts[str(user_id)] = cart
+            for cart_item_id in [key for key, item in self.cart_items.items() if item["cart"] == cart["id"]]:
+                del self.cart_items[cart_item_id]
+            for product_id in itertools.islice(itertools.cycle(self.products), items):
+                cart_item_id = self.next_id()
+                self.cart_items[cart_item_id] = {
+                    "id": cart_item_id,
+                    "documentId": f"item{cart_item_id}",
+                    "quantity": 1,
+                    "cart": cart["id"],
+                    "product": product_id,
+                }
+            return cart
+
+    def user_cart_items(self, user_id):
+        cart = self.carts.get(str(user_id))
+        if not cart:
+            return []
+        return [item for item in self.cart_items.values() if item["cart"] == cart["id"]]
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def _count(self, method, path):
+        route = re.sub(r"/[^/]*\d[^/]*$", "/:id", path)
+        with self._lock:
+            self.calls[f"{method} {route}"] += 1
+
+    def _make_handler(self):
+        strapi = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+            def do_DELETE(self):
+                self._dispatch("DELETE")
+
+            def _dispatch(self, method):
+                split_url = urlsplit(self.path)
+                query = {key: values[-1] for key, values in parse_qs(split_url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else {}
+                strapi._count(method, split_url.path)
+                if strapi.latency:
+                    time.sleep(strapi.latency)
+                with strapi._lock:
+                    status, payload = strapi.route(method, split_url.path, query, body)
+                if status == 204:
+                    content, content_type = b"", "application/json"
+                elif isinstance(payload, bytes):
+                    content, content_type = payload, "image/jpeg"
+                else:
+                    content, content_type = json.dumps(payload).encode(), "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        return Handler
+
+    def route(self, method, path, query, body):
+        if path.startswith("/uploads/") and method == "GET":
+            return 200, b"\xff" * self.image_size
+        match = re.fullmatch(r"/api/([a-z-]+)(?:/([^/]+))?", path)
+        if not match:
+            return 404, {"error": {"status": 404, "message": "Not Found"}}
+        collection, document_id = match.groups()
+        handler = getattr(self, f"{method.lower()}_{collection.replace('-', '_')}", None)
+        if handler is None:
+            return 405, {"error": {"status": 405, "message": "Method Not Allowed"}}
+        return handler(document_id, query, body)
+
+    def paginate(self, items, query):
+        page = int(query.get("pagination[page]", 1))
+        page_size = min(int(query.get("pagination[pageSize]", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        start = (page - 1) * page_size
+        return 200, {
+            "data": items[start:start + page_size],
+            "meta": {"pagination": {
+                "page": page,
+                "pageSize": page_size,
+                "pageCount": (len(items) + page_size - 1) // page_size,
+                "total": len(items),
+            }},
+        }
+
+    def get_products(self, document_id, query, body):
+        products = list(self.products.values())
+        updated_since = query.get("filters[updatedAt][$gte]")
+        if updated_since:
+            products = [product for product in products if product["updatedAt"] >= updated_since]
+        fields = [value for key, value in query.items() if key.startswith("fields[")]
+        if fields:
+            products = [self.project_product(product, fields, query) for product in products]
+        return self.paginate(products, query)
+
+    def project_product(self, product, fields, query):
+        projected = {key: product[key] for key in ("id", "documentId", *fields)}
+        image_fields = [value for key, value in query.items() if key.startswith("populate[image][fields]")]
+        if image_fields:
+            projected["image"] = {key: product["image"][key] for key in ("id", *image_fields)}
+        elif query.get("populate") == "*":
+            projected["image"] = product["image"]
+        return projected
+
+    def get_carts(self, document_id, query, body):
+        cart = self.carts.get(query.get("filters[telegramId][$eq]"))
+        carts = [cart] if cart else []
+        if "populate" in query:
+            carts = [self.populate_cart(cart) for cart in carts]
+        return self.paginate(carts, query)
+
+    def populate_cart(self, cart):
+        cart_items = []
+        for item in self.cart_items.values():
+            if item["cart"] != cart["id"]:
+                continue
+            product = {key: value for key, value in self.products[item["product"]].items() if key != "image"}
+            cart_items.append({**self.public_cart_item(item), "product": product})
+        return {**cart, "cart_items": cart_items}
+
+    def public_cart_item(self, item):
+        return {"id": item["id"], "documentId": item["documentId"], "quantity": item["quantity"]}
+
+    def post_carts(self, document_id, query, body):
+        cart_id = self.next_id()
+        cart = {"id": cart_id, "documentId": f"cart{cart_id}", "telegramId": str(body["data"]["telegramId"])}
+        self.carts[cart["telegramId"]] = cart
+        return 201, {"data": cart}
+
+    def get_cart_items(self, document_id, query, body):
+        cart_item_id = int(query.get("filters[id][$eq]", 0))
+        items = [self.public_cart_item(self.cart_items[cart_item_id])] if cart_item_id in self.cart_items else []
+        return self.paginate(items, query)
+
+    def post_cart_items(self, document_id, query, body):
+        data = body["data"]
+        cart_item_id = self.next_id()
+        self.cart_items[cart_item_id] = {
+            "id": cart_item_id,
+            "documentId": f"item{cart_item_id}",
+            "quantity": data["quantity"],
+            "cart": int(data["cart_item"]),
+            "product": int(data["product"]),
+        }
+        return 201, {"data": self.public_cart_item(self.cart_items[cart_item_id])}
+
+    def find_cart_item(self, document_id):
+        return next((item for item in self.cart_items.values() if item["documentId"] == document_id), None)
+
+    def put_cart_items(self, document_id, query, body):
+        item = self.find_cart_item(document_id)
+        if not item:
+            return 404, {"error": {"status": 404, "message": "Not Found"}}
+        item["quantity"] = body["data"]["quantity"]
+        return 200, {"data": self.public_cart_item(item)}
+
+    def delete_cart_items(self, document_id, query, body):
+        item = self.find_cart_item(document_id)
+        if not item:
+            return 404, {"error": {"status": 404, "message": "Not Found"}}
+        del self.cart_items[item["id"]]
+        return 204, {}
+
+    def post_orders(self, document_id, query, body):
+        order_id = self.next_id()
+        self.orders[order_id] = {"id": order_id, "documentId": f"order{order_id}", **body["data"]}
+        return 201, {"data": self.orders[order_id]}
+
+    def delete_orders(self, document_id, query, body):
+        order = next((order for order in self.orders.values() if order["documentId"] == document_id), None)
+        if not order:
+            return 404, {"error": {"status": 404, "message": "Not Found"}}
+        del self.orders[order["id"]]
+        return 204, {}
+
+    def post_order_items(self, document_id, query, body):
+        order_item_id = self.next_id()
+        data = body["data"]
+        self.order_items[order_item_id] = {
+            "id": order_item_id,
+            "documentId": f"orderitem{order_item_id}",
+            "quantity": data["quantity"],
+            "order": data["order"]["connect"],
+            "product": data["product"]["connect"],
+        }
+        return 201, {"data": self.order_items[order_item_id]}
+
+    def delete_order_items(self, document_id, query, body):
+        order_item = next((item for item in self.order_items.values() if item["documentId"] == document_id), None)
+        if not order_item:
+            return 404, {"error": {"status": 404, "message": "Not Found"}}
+        del self.order_items[order_item["id"]]
+        return 204, {}
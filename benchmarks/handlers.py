@@ -0,0 +1,306 @@
+import argparse
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from telegram import InputFile
+from telegram.error import RetryAfter
+
+from api import get_user_cart_with_items, init_strapi_session
+from benchmarks.fake_strapi import FakeStrapi
+from carts import cart_cache
+from catalog import CatalogCache
+from coalescer import CartCoalescer
+from images import ImageCache
+from orders import OrderQueue, OrderWorkerPool
+from outbound import OutboundBot, OutboundScheduler
+from render import RenderCache
+from views import ViewTracker
+import tg_bot
+
+
+EXPECTED_CALLS = {
+    "handle_menu": lambda cart_items: 0,
+    "handle_show_product": lambda cart_items: 0,
+    "handle_add_to_cart": lambda cart_items: 1,
+    "handle_remove_product": lambda cart_items: 1,
+    "handle_email": lambda cart_items: 1,
+}
+EXPECTED_TELEGRAM_CALLS = {
+    "handle_menu": 1,
+    "handle_show_product": 2,
+    "handle_add_to_cart": 0,
+    "handle_remove_product": 1,
+    "handle_email": 1,
+}
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+        self.rate_limited = 0
+        self.uploads = []
+
+    def next_message_id(self):
+        return next(self._message_ids)
+
+    def _record(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        return SimpleNamespace(message_id=self.next_message_id(), chat_id=kwargs.get("chat_id"))
+
+    def send_message(self, **kwargs):
+        return self._record("send_message", **kwargs)
+
+    def send_photo(self, photo, **kwargs):
+        if not isinstance(photo, str):
+            self.uploads.append(len(InputFile(photo).input_file_content))
+        if self.rate_limited:
+            self.rate_limited -= 1
+            raise RetryAfter(0)
+        message = self._record("send_photo", photo=photo, **kwargs)
+        message.photo = [SimpleNamespace(file_id=f"file{next(self._file_ids)}")]
+        return message
+
+    def delete_message(self, **kwargs):
+        self._record("delete_message", **kwargs)
+        return True
+
+    def edit_message_text(self, **kwargs):
+        return self._record("edit_message_text", **kwargs)
+
+    def edit_message_reply_markup(self, **kwargs):
+        return self._record("edit_message_reply_markup", **kwargs)
+
+    def edit_message_caption(self, **kwargs):
+        return self._record("edit_message_caption", **kwargs)
+
+    def edit_message_media(self, **kwargs):
+        message = self._record("edit_message_media", **kwargs)
+        message.photo = [SimpleNamespace(file_id=f"file{next(self._file_ids)}")]
+        return message
+
+    def telegram_calls(self, since):
+        return sum(1 for method, _ in self.calls[since:] if method != "answer_callback_query")
+
+    def answer_callback_query(self, **kwargs):
+        self._record("answer_callback_query", **kwargs)
+        return True
+
+
+class FakeMessage:
+    def __init__(self, bot, user_id, text=None, reply_markup=None):
+        self.bot = bot
+        self.from_user = SimpleNamespace(id=user_id)
+        self.chat_id = user_id
+        self.message_id = bot.next_message_id()
+        self.text = text
+        self.caption = None
+        self.photo = None
+        self.reply_markup = reply_markup
+
+    def reply_text(self, text, **kwargs):
+        return self.bot.send_message(chat_id=self.chat_id, text=text, **kwargs)
+
+
+class FakeCallbackQuery:
+    def __init__(self, bot, user_id, data):
+        self.bot = bot
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = FakeMessage(bot, user_id)
+
+    def answer(self, text=None, show_alert=False):
+        return self.bot.answer_callback_query(text=text, show_alert=show_alert)
+
+    def edit_message_text(self, text, **kwargs):
+        return self.bot.edit_message_text(chat_id=self.message.chat_id, message_id=self.message.message_id, text=text, **kwargs)
+
+    def edit_message_reply_markup(self, **kwargs):
+        return self.bot.edit_message_reply_markup(chat_id=self.message.chat_id, message_id=self.message.message_id, **kwargs)
+
+
+def callback_update(bot, user_id, data):
+    return SimpleNamespace(callback_query=FakeCallbackQuery(bot, user_id, data), message=None)
+
+
+def message_update(bot, user_id, text):
+    return SimpleNamespace(callback_query=None, message=FakeMessage(bot, user_id, text=text))
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class HandlerBench:
+    def __init__(self, strapi, cart_items):
+        self.strapi = strapi
+        self.cart_items = cart_items
+        self.bot = FakeBot()
+        session = init_strapi_session(token="benchmark")
+        catalog = CatalogCache(session, strapi.url)
+        images = ImageCache(session, strapi.url)
+        catalog.subscribe(images.sync)
+        outbound = OutboundBot(self.bot, OutboundScheduler(global_rate=10 ** 6, chat_rate=10 ** 6, chat_burst=10 ** 6))
+        orders = OrderQueue(os.path.join(tempfile.mkdtemp(), "orders.sqlite3"))
+        self.bot_data = {
+            "strapi_session": session,
+            "api_url": strapi.url,
+            "catalog": catalog,
+            "images": images,
+            "render": RenderCache(catalog),
+            "outbound": outbound,
+            "orders": OrderWorkerPool(orders, session, strapi.url, outbound),
+            "cart_coalescer": CartCoalescer(session, strapi.url, outbound).start(),
+            "views": ViewTracker(outbound, images),
+        }
+        self.user_data = {}
+        self.user_id = "100"
+        self.product_id = next(iter(strapi.products))
+
+    def context(self):
+        return SimpleNamespace(bot=self.bot, bot_data=self.bot_data, user_data=self.user_data)
+
+    def warm_cart(self, items):
+        self.strapi.seed_cart(self.user_id, items)
+        cart_cache.invalidate(self.user_id)
+        session, api_url = self.bot_data["strapi_session"], self.bot_data["api_url"]
+        return get_user_cart_with_items(session, api_url, self.user_id)
+
+    def prepare_menu(self):
+        self.warm_cart(self.cart_items)
+        return tg_bot.handle_menu, callback_update(self.bot, self.user_id, "back")
+
+    def prepare_show_product(self):
+        self.bot_data["catalog"].get()
+        self.user_data["user_reply"] = str(self.product_id)
+        return tg_bot.handle_show_product, callback_update(self.bot, self.user_id, str(self.product_id))
+
+    def prepare_add_to_cart(self):
+        self.warm_cart(self.cart_items)
+        self.user_data.update(product_id=self.product_id, quantity=2)
+        return tg_bot.handle_add_to_cart, callback_update(self.bot, self.user_id, f"add_cart_{self.product_id}")
+
+    def prepare_remove_product(self):
+        cart = self.warm_cart(max(self.cart_items, 1))
+        cart_item_id = cart["cart_items"][0]["id"]
+        self.user_data["cart_item_id"] = cart_item_id
+        return tg_bot.handle_remove_product, callback_update(self.bot, self.user_id, f"remove_{cart_item_id}")
+
+    def prepare_email(self):
+        self.warm_cart(self.cart_items)
+        return tg_bot.handle_email, message_update(self.bot, self.user_id, "buyer@example.com")
+
+    def upload_after_retry(self):
+        product = self.bot_data["catalog"].get()[self.product_id]
+        self.bot_data["images"].invalidate(product.image_url)
+        self.bot.uploads.clear()
+        self.bot.rate_limited = 1
+        handler, update = self.prepare_show_product()
+        handler(update, self.context())
+        return self.bot.uploads
+
+    def run(self, name, prepare, iterations):
+        errors = ErrorCounter()
+        logging.getLogger("errors").addHandler(errors)
+        durations, calls, telegram_calls = [], [], []
+        try:
+            for iteration in range(iterations + 1):
+                handler, update = prepare()
+                self.strapi.reset_calls()
+                sent_before = len(self.bot.calls)
+                started_at = time.perf_counter()
+                handler(update, self.context())
+                duration = time.perf_counter() - started_at
+                self.bot_data["cart_coalescer"].flush(self.user_id)
+                if iteration:
+                    durations.append(duration)
+                    calls.append(self.strapi.total_calls())
+                    telegram_calls.append(self.bot.telegram_calls(sent_before))
+        finally:
+            logging.getLogger("errors").removeHandler(errors)
+        return {
+            "handler": name,
+            "durations": durations,
+            "calls": max(calls),
+            "expected_calls": EXPECTED_CALLS[name](self.cart_items),
+            "telegram_calls": max(telegram_calls),
+            "expected_telegram_calls": EXPECTED_TELEGRAM_CALLS[name],
+            "errors": errors.count,
+        }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_report(results):
+    print(f"{'handler':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'calls':>8}{'budget':>8}{'tg':>6}{'tg max':>8}{'errors':>8}")
+    for result in results:
+        durations = result["durations"]
+        print(
+            f"{result['handler']:<24}"
+            f"{percentile(durations, 0.5) * 1000:>10.2f}"
+            f"{percentile(durations, 0.95) * 1000:>10.2f}"
+            f"{percentile(durations, 0.99) * 1000:>10.2f}"
+            f"{result['calls']:>8}"
+            f"{result['expected_calls']:>8}"
+            f"{result['telegram_calls']:>6}"
+            f"{result['expected_telegram_calls']:>8}"
+            f"{result['errors']:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер стоимости обработчиков бота на локальном имитаторе Strapi")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.005, help="Задержка ответа Strapi в секундах")
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--cart-items", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    strapi = FakeStrapi(products=args.products, latency=args.latency).start()
+    try:
+        bench = HandlerBench(strapi, args.cart_items)
+        scenarios = {
+            "handle_menu": bench.prepare_menu,
+            "handle_show_product": bench.prepare_show_product,
+            "handle_add_to_cart": bench.prepare_add_to_cart,
+            "handle_remove_product": bench.prepare_remove_product,
+            "handle_email": bench.prepare_email,
+        }
+        results = [bench.run(name, prepare, args.iterations) for name, prepare in scenarios.items()]
+        uploads = bench.upload_after_retry()
+    finally:
+        strapi.stop()
+
+    print_report(results)
+    print(f"Загрузка фото после RetryAfter, байт по попыткам: {uploads}")
+    failed = [
+        result["handler"] for result in results
+        if result["calls"] > result["expected_calls"]
+        or result["telegram_calls"] > result["expected_telegram_calls"]
+        or result["errors"]
+    ]
+    if len(uploads) != 2 or not uploads[0] or uploads[1] != uploads[0]:
+        failed.append("send_photo после RetryAfter")
+    if failed:
+        print(f"Превышен бюджет запросов к Strapi или Telegram, или есть ошибки: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
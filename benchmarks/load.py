@@ -0,0 +1,343 @@
+import argparse
+import itertools
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from queue import Queue
+from types import SimpleNamespace
+
+from environs import Env
+from telegram.ext import Dispatcher
+
+from benchmarks.fake_strapi import FakeStrapi
+from benchmarks.handlers import ErrorCounter, percentile
+from webhook import UpdateWorkerPool
+import tg_bot
+
+
+STEPS = ("start", "menu", "product", "quantity", "add", "back", "product", "quantity", "add", "cart", "remove", "pay", "email")
+
+
+class LoadStopped(Exception):
+    pass
+
+
+class StubBot:
+    username = "fish_shop_bot"
+    defaults = None
+    id = 1
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+        self._last_messages = {}
+        self._lock = threading.Lock()
+
+    def _respond(self, chat_id, text=None, reply_markup=None, message_id=None, photo=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            message = self._last_messages.get(chat_id, {}) if message_id else {}
+            message = {
+                **message,
+                "message_id": message_id or next(self._message_ids),
+                "date": 0,
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            if photo:
+                message["photo"] = [{"file_id": photo, "file_unique_id": photo, "width": 1, "height": 1}]
+            if text is not None:
+                message["caption" if "photo" in message else "text"] = text
+            if reply_markup:
+                message["reply_markup"] = reply_markup.to_dict()
+            self._last_messages[chat_id] = message
+        result = SimpleNamespace(message_id=message["message_id"], chat_id=chat_id)
+        if photo:
+            result.photo = [SimpleNamespace(file_id=photo)]
+        return result
+
+    def last_message(self, chat_id):
+        with self._lock:
+            return self._last_messages.get(chat_id)
+
+    def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        return self._respond(chat_id, text, reply_markup)
+
+    def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        return self._respond(chat_id, caption, reply_markup, photo=f"file{next(self._file_ids)}")
+
+    def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        return self._respond(chat_id, text, reply_markup, message_id)
+
+    def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None, **kwargs):
+        return self._respond(chat_id, None, reply_markup, message_id)
+
+    def edit_message_caption(self, chat_id, message_id, caption=None, reply_markup=None, **kwargs):
+        return self._respond(chat_id, caption, reply_markup, message_id)
+
+    def edit_message_media(self, chat_id, message_id, media, reply_markup=None, **kwargs):
+        return self._respond(chat_id, media.caption, reply_markup, message_id, photo=f"file{next(self._file_ids)}")
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+        return True
+
+    def answer_callback_query(self, callback_query_id, text=None, show_alert=False, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return True
+
+
+class TrackingDispatcher:
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.bot = dispatcher.bot
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def expect(self, update_id):
+        done = threading.Event()
+        with self._lock:
+            self._waiters[update_id] = done
+        return done
+
+    def process_update(self, update):
+        try:
+            self.dispatcher.process_update(update)
+        finally:
+            with self._lock:
+                done = self._waiters.pop(update.update_id, None)
+            if done:
+                done.set()
+
+
+class LoadRun:
+    def __init__(self, dispatcher, pool, bot, user_ids, think_time):
+        self.dispatcher = dispatcher
+        self.pool = pool
+        self.bot = bot
+        self.user_ids = user_ids
+        self.think_time = think_time
+        self.update_ids = itertools.count(1)
+        self.latencies = defaultdict(list)
+        self.sessions = 0
+        self.rejected = 0
+        self.stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def send(self, step, data):
+        if self.stopped.is_set():
+            raise LoadStopped()
+        update_id = next(self.update_ids)
+        data["update_id"] = update_id
+        done = self.dispatcher.expect(update_id)
+        started_at = time.perf_counter()
+        if not self.pool.submit(data):
+            with self._lock:
+                self.rejected += 1
+            while not self.pool.submit(data):
+                time.sleep(0.01)
+        done.wait()
+        with self._lock:
+            self.latencies[step].append(time.perf_counter() - started_at)
+        if self.think_time:
+            time.sleep(random.uniform(0, 2 * self.think_time))
+
+    def command(self, step, user_id, text):
+        entities = [{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith("/") else []
+        self.send(step, {"message": {
+            "message_id": next(self.update_ids),
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+            "text": text,
+            "entities": entities,
+        }})
+
+    def press(self, step, user_id, callback_data):
+        message = self.bot.last_message(user_id) or {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+        }
+        self.send(step, {"callback_query": {
+            "id": str(next(self.update_ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+            "chat_instance": str(user_id),
+            "data": callback_data,
+            "message": message,
+        }})
+
+    def buttons(self, user_id, predicate):
+        message = self.bot.last_message(user_id) or {}
+        rows = (message.get("reply_markup") or {}).get("inline_keyboard", [])
+        return [button["callback_data"] for row in rows for button in row if predicate(button["callback_data"])]
+
+    def session(self, user_id):
+        self.command("start", user_id, "/start")
+        self.press("menu", user_id, "show_products")
+        for step in ("first", "second"):
+            if step == "second":
+                self.press("back", user_id, "back")
+            product_id = random.choice(self.buttons(user_id, str.isdigit))
+            self.press("product", user_id, product_id)
+            self.press("quantity", user_id, f"quantity_{random.choice([1, 2, 5, 10])}")
+            self.press("add", user_id, f"add_cart_{product_id}")
+        self.press("cart", user_id, "my_cart")
+        removable = self.buttons(user_id, lambda data: data.startswith("remove_"))
+        if removable:
+            self.press("remove", user_id, removable[0])
+        self.press("pay", user_id, "pay")
+        self.command("email", user_id, f"user{user_id}@example.com")
+        with self._lock:
+            self.sessions += 1
+
+    def user_loop(self, user_id):
+        while not self.stopped.is_set():
+            try:
+                self.session(user_id)
+            except LoadStopped:
+                return
+            except IndexError:
+                time.sleep(0.1)
+
+    def run(self, duration):
+        threads = [threading.Thread(target=self.user_loop, args=(user_id,), daemon=True) for user_id in self.user_ids]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        self.stopped.set()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started_at
+
+
+def create_dispatcher(strapi, bot):
+    os.environ.update(
+        STRAPI_URL=strapi.url,
+        STRAPI_API_TOKEN="load",
+        TG_GLOBAL_RATE=str(10 ** 6),
+        TG_CHAT_RATE=str(10 ** 6),
+        TG_CHAT_BURST=str(10 ** 6),
+        METRICS_PORT="0",
+        ORDER_QUEUE_PATH=os.path.join(tempfile.mkdtemp(), "orders.sqlite3"),
+        CATALOG_SNAPSHOT_PATH="",
+    )
+    dispatcher = Dispatcher(bot, Queue(), workers=0)
+    tg_bot.setup_dispatcher(dispatcher, Env())
+    return dispatcher
+
+
+def run_level(dispatcher, bot, users, first_user_id, args):
+    tracking = TrackingDispatcher(dispatcher)
+    pool = UpdateWorkerPool(tracking, workers=args.workers, queue_size=args.queue_size)
+    pool.start()
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    telegram_calls = bot.calls
+    try:
+        run = LoadRun(tracking, pool, bot, range(first_user_id, first_user_id + users), args.think_time)
+        elapsed = run.run(args.duration)
+    finally:
+        logging.getLogger().removeHandler(errors)
+        pool.stop()
+    latencies = [value for values in run.latencies.values() for value in values]
+    return {
+        "users": users,
+        "throughput": len(latencies) / elapsed,
+        "sessions": run.sessions / elapsed,
+        "latencies": latencies,
+        "steps": run.latencies,
+        "rejected": run.rejected,
+        "errors": errors.count,
+        "telegram_per_update": (bot.calls - telegram_calls) / max(len(latencies), 1),
+    }
+
+
+def find_saturation(results, min_gain):
+    best = results[0]
+    for result in results[1:]:
+        if result["throughput"] < best["throughput"] * (1 + min_gain):
+            return best
+        best = result
+    return None
+
+
+def print_report(results, saturation):
+    print(f"{'users':>8}{'upd/s':>10}{'sessions/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rejected':>10}{'errors':>8}{'tg/upd':>8}")
+    for result in results:
+        latencies = result["latencies"] or [0]
+        print(
+            f"{result['users']:>8}"
+            f"{result['throughput']:>10.1f}"
+            f"{result['sessions']:>12.2f}"
+            f"{percentile(latencies, 0.5) * 1000:>10.1f}"
+            f"{percentile(latencies, 0.95) * 1000:>10.1f}"
+            f"{percentile(latencies, 0.99) * 1000:>10.1f}"
+            f"{result['rejected']:>10}"
+            f"{result['errors']:>8}"
+            f"{result['telegram_per_update']:>8.2f}"
+        )
+
+    for result in results:
+        print(f"\nШаги при {result['users']} пользователях:")
+        print(f"{'step':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for step in dict.fromkeys(STEPS):
+            durations = result["steps"].get(step)
+            if not durations:
+                continue
+            print(
+                f"{step:<12}{len(durations):>8}"
+                f"{percentile(durations, 0.5) * 1000:>10.1f}"
+                f"{percentile(durations, 0.95) * 1000:>10.1f}"
+                f"{percentile(durations, 0.99) * 1000:>10.1f}"
+            )
+
+    if saturation:
+        print(f"\nНасыщение: около {saturation['users']} пользователей, {saturation['throughput']:.1f} обновлений/с")
+    else:
+        print("\nНасыщение не достигнуто, увеличьте число пользователей")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон сценариев пользователей через ConversationHandler бота")
+    parser.add_argument("--users", type=int, nargs="+", default=[50, 100, 250, 500, 1000, 2000])
+    parser.add_argument("--duration", type=float, default=10, help="Длительность каждой ступени в секундах")
+    parser.add_argument("--workers", type=int, default=4, help="Число потоков обработки обновлений, как UPDATE_WORKERS")
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--think-time", type=float, default=2.0, help="Средняя пауза пользователя между шагами в секундах")
+    parser.add_argument("--strapi-latency", type=float, default=0.005)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--min-gain", type=float, default=0.1, help="Минимальный прирост пропускной способности между ступенями")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    strapi = FakeStrapi(products=args.products, latency=args.strapi_latency).start()
+    try:
+        bot = StubBot(latency=args.telegram_latency)
+        dispatcher = create_dispatcher(strapi, bot)
+        results = []
+        first_user_id = 1
+        for users in args.users:
+            results.append(run_level(dispatcher, bot, users, first_user_id, args))
+            first_user_id += users
+    finally:
+        strapi.stop()
+
+    print_report(results, find_saturation(results, args.min_gain))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import gc
+import subprocess
+import sys
+
+from api import get_products, init_strapi_session
+from benchmarks.fake_strapi import FakeStrapi
+from catalog import CatalogCache
+
+
+SCENARIOS = ("baseline", "user_data_products", "catalog_snapshot")
+
+
+def get_rss_bytes():
+    with open("/proc/self/statm") as statm:
+        resident_pages = int(statm.read().split()[1])
+    return resident_pages * 4096
+
+
+def simulate(scenario, users, products, refreshes):
+    strapi = FakeStrapi(products=products).start()
+    try:
+        session = init_strapi_session(token="benchmark")
+        catalog = CatalogCache(session, strapi.url)
+        refresh_every = max(1, users // max(1, refreshes))
+        user_data = {}
+        catalog_products = None
+        gc.collect()
+        started_rss = get_rss_bytes()
+        for user_id in range(users):
+            if user_id % refresh_every == 0:
+                strapi.add_product()
+                if scenario == "user_data_products":
+                    catalog_products = get_products(session, strapi.url)
+                elif scenario == "catalog_snapshot":
+                    catalog.invalidate()
+                    catalog._load()
+            data = {"product_id": 1, "quantity": 1}
+            if scenario == "user_data_products":
+                data["products"] = catalog_products
+            user_data[user_id] = data
+        gc.collect()
+        return get_rss_bytes() - started_rss
+    finally:
+        strapi.stop()
+
+
+def run_scenario(scenario, args):
+    output = subprocess.run(
+        [
+            sys.executable, "-m", "benchmarks.memory",
+            "--scenario", scenario,
+            "--users", str(args.users),
+            "--products", str(args.products),
+            "--refreshes", str(args.refreshes),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return int(output.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер памяти, занимаемой каталогом в user_data пользователей")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--refreshes", type=int, default=100, help="Сколько раз каталог обновляется за время замера")
+    parser.add_argument("--scenario", choices=SCENARIOS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(simulate(args.scenario, args.users, args.products, args.refreshes))
+        return
+
+    results = {scenario: run_scenario(scenario, args) for scenario in SCENARIOS}
+    baseline = results["baseline"]
+    print(f"{'scenario':<24}{'RSS MB':>10}{'per user B':>12}")
+    for scenario, rss in results.items():
+        print(f"{scenario:<24}{rss / 1024 / 1024:>10.1f}{(rss - baseline) / args.users:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
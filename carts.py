@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+class CartCache:
+    def __init__(self, max_size=10000, max_age=60):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._carts = OrderedDict()
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def configure(self, max_size, max_age):
+        with self._lock:
+            self.max_size = max_size
+            self.max_age = max_age
+            self._evict()
+
+    def get(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            entry = self._carts.get(key)
+            if entry is None:
+                return MISSING
+            cart, stored_at = entry
+            if time.monotonic() - stored_at > self.max_age:
+                return MISSING
+            self._carts.move_to_end(key)
+            return cart
+
+    def put(self, user_id, cart):
+        key = str(user_id)
+        with self._lock:
+            self._store(key, cart, time.monotonic())
+            self._carts.move_to_end(key)
+            self._evict()
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._carts.clear()
+                self._items.clear()
+            else:
+                self._drop(str(user_id))
+
+    def find_item(self, cart_item_id):
+        with self._lock:
+            return self._items.get(int(cart_item_id))
+
+    def update_item(self, user_id, cart_item):
+        def change(items):
+            if any(item.get("id") == cart_item["id"] for item in items):
+                return [cart_item if item.get("id") == cart_item["id"] else item for item in items]
+            return items + [cart_item]
+
+        self._replace_items(user_id, change)
+
+    def remove_item(self, user_id, cart_item_id):
+        self._replace_items(
+            user_id,
+            lambda items: [item for item in items if item.get("id") != int(cart_item_id)],
+        )
+
+    def _replace_items(self, user_id, change):
+        key = str(user_id)
+        with self._lock:
+            entry = self._carts.get(key)
+            if entry is None or entry[0] is None:
+                return
+            cart, stored_at = entry
+            updated_cart = {**cart, "cart_items": change(cart.get("cart_items", []))}
+            self._store(key, updated_cart, stored_at)
+
+    def _store(self, key, cart, stored_at):
+        self._unindex(key)
+        self._carts[key] = (cart, stored_at)
+        for item in (cart or {}).get("cart_items", []):
+            self._items[item["id"]] = (key, item["documentId"])
+
+    def _drop(self, key):
+        self._unindex(key)
+        self._carts.pop(key, None)
+
+    def _unindex(self, key):
+        entry = self._carts.get(key)
+        if entry is None or entry[0] is None:
+            return
+        for item in entry[0].get("cart_items", []):
+            self._items.pop(item["id"], None)
+
+    def _evict(self):
+        while len(self._carts) > self.max_size:
+            self._drop(next(iter(self._carts)))
+
+
+cart_cache = CartCache()
@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from api import get_product_ids, iter_products
+from errors import NetworkError, ServerError
+from images import get_small_image_url
+
+
+logger = logging.getLogger(__name__)
+SNAPSHOT_FORMAT = 1
+
+
+class Product:
+    __slots__ = ("id", "title", "price", "description", "image_url")
+
+    def __init__(self, id, title, price, description, image_url):
+        self.id = id
+        self.title = title
+        self.price = price
+        self.description = description
+        self.image_url = image_url
+
+    @classmethod
+    def from_strapi(cls, item):
+        return cls(
+            item["id"],
+            item.get("title"),
+            item.get("price"),
+            item.get("description"),
+            get_small_image_url(item),
+        )
+
+    def as_row(self):
+        return list(self._fields())
+
+    def as_dict(self):
+        return {"id": self.id, "title": self.title, "price": self.price, "description": self.description}
+
+    def _fields(self):
+        return (self.id, self.title, self.price, self.description, self.image_url)
+
+    def __eq__(self, other):
+        if not isinstance(other, Product):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+
+class CatalogSnapshot:
+    __slots__ = ("version", "products")
+
+    def __init__(self, version, products):
+        self.version = version
+        self.products = MappingProxyType(products)
+
+
+EMPTY_SNAPSHOT = CatalogSnapshot(0, {})
+
+
+class CatalogCache:
+    def __init__(self, session, api_url, ttl=300, retry_delay=30, delta_sync=False, id_check_interval=600, snapshot_path=None):
+        self.session = session
+        self.api_url = api_url
+        self.ttl = ttl
+        self.retry_delay = retry_delay
+        self.delta_sync = delta_sync
+        self.id_check_interval = id_check_interval
+        self.snapshot_path = snapshot_path
+        self._snapshot = None
+        self._loaded_at = 0
+        self._watermark = None
+        self._ids_checked_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._listeners = []
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    @property
+    def version(self):
+        return (self._snapshot or EMPTY_SNAPSHOT).version
+
+    def get(self):
+        return self.snapshot().products
+
+    def snapshot(self):
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._load()
+            return self._snapshot
+
+        if time.monotonic() - self._loaded_at > self.ttl:
+            self._start_refresh()
+        return self._snapshot
+
+    def warm_up(self):
+        if self.snapshot_path and self.restore():
+            self._start_refresh()
+            return
+        try:
+            self.get()
+        except (ServerError, NetworkError) as error:
+            logger.warning(f"Не удалось загрузить каталог при старте: {error}")
+
+    def invalidate(self):
+        self._loaded_at = 0
+
+    def restore(self):
+        try:
+            with open(self.snapshot_path, "rb") as snapshot_file:
+                data = json.load(snapshot_file)
+            if data.get("format") != SNAPSHOT_FORMAT:
+                return False
+            products = {row[0]: Product(*row) for row in data["products"]}
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logger.warning(f"Не удалось прочитать снимок каталога {self.snapshot_path}: {error}")
+            return False
+        with self._lock:
+            if self._snapshot is not None:
+                return True
+            self._watermark = data.get("watermark")
+            self._publish(products, save=False)
+        logger.info(f"Каталог загружен из снимка {self.snapshot_path}: {len(products)} продуктов")
+        return True
+
+    def save(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        data = {
+            "format": SNAPSHOT_FORMAT,
+            "watermark": self._watermark,
+            "products": [product.as_row() for product in snapshot.products.values()],
+        }
+        temporary_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "w") as snapshot_file:
+                json.dump(data, snapshot_file, ensure_ascii=False, separators=(",", ":"))
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(temporary_path, self.snapshot_path)
+        except OSError as error:
+            logger.warning(f"Не удалось сохранить снимок каталога {self.snapshot_path}: {error}")
+
+    def _load(self):
+        products = {}
+        watermark = ""
+        for item in iter_products(self.session, self.api_url):
+            products[item["id"]] = Product.from_strapi(item)
+            watermark = max(watermark, item.get("updatedAt") or "")
+        self._watermark = watermark or None
+        self._ids_checked_at = time.monotonic()
+        self._publish(products)
+
+    def _sync(self):
+        if self._watermark is None:
+            self._load()
+            return
+        products = dict(self._snapshot.products)
+        watermark = self._watermark
+        for item in iter_products(self.session, self.api_url, updated_since=self._watermark):
+            products[item["id"]] = Product.from_strapi(item)
+            watermark = max(watermark, item.get("updatedAt") or "")
+        if time.monotonic() - self._ids_checked_at > self.id_check_interval:
+            product_ids = get_product_ids(self.session, self.api_url)
+            self._ids_checked_at = time.monotonic()
+            if not product_ids <= products.keys():
+                logger.info("В каталоге появились продукты, пропущенные при частичном обновлении, каталог загружается целиком")
+                self._load()
+                return
+            for product_id in products.keys() - product_ids:
+                del products[product_id]
+        self._watermark = watermark
+        self._publish(products)
+
+    def _publish(self, products, save=True):
+        current = self._snapshot or EMPTY_SNAPSHOT
+        self._loaded_at = time.monotonic()
+        if self._snapshot is not None and products == current.products:
+            return
+        self._snapshot = CatalogSnapshot(current.version + 1, products)
+        for callback in self._listeners:
+            callback(self._snapshot.products)
+        if save and self.snapshot_path:
+            self.save()
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self):
+        try:
+            if self.delta_sync:
+                self._sync()
+            else:
+                self._load()
+        except (ServerError, NetworkError) as error:
+            logger.warning(f"Не удалось обновить каталог, используется сохранённый: {error}")
+            self._loaded_at = time.monotonic() - self.ttl + self.retry_delay
+        finally:
+            self._refreshing = False
@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import TelegramError
+
+from api import add_to_cart, get_or_create_user_cart
+from errors import NetworkError, ServerError
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+LOCK_STRIPES = 64
+FLUSH_ATTEMPTS = 3
+
+
+class CartCoalescer:
+    def __init__(self, session, api_url, outbound, window=0.5, workers=4):
+        self.session = session
+        self.api_url = api_url
+        self.outbound = outbound
+        self.window = window
+        self.merged = 0
+        self.flushed = 0
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cart-flush")
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="cart-coalescer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        metrics.add_collector(self.render_stats)
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._executor.shutdown()
+        for key in list(self._pending):
+            self._flush_in_background(key, self._pending[key]["chat_id"], final=True)
+
+    def add(self, user_id, chat_id, product_id, quantity, product=None):
+        key = str(user_id)
+        if not self.window:
+            self._apply(key, {int(product_id): [quantity, product]})
+            return
+        with self._condition:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = {"chat_id": chat_id, "due_at": time.monotonic() + self.window, "products": {}, "flushing": False, "attempts": 0}
+                self._pending[key] = entry
+                self._condition.notify()
+            else:
+                self.merged += 1
+            line = entry["products"].setdefault(int(product_id), [0, product])
+            line[0] += quantity
+
+    def pending_products(self, user_id):
+        with self._condition:
+            entry = self._pending.get(str(user_id))
+            return set(entry["products"]) if entry else set()
+
+    def count_items(self, user_id, cart):
+        in_cart = {item.get("product", {}).get("id") for item in (cart or {}).get("cart_items", [])}
+        return len(in_cart) + len(self.pending_products(user_id) - in_cart)
+
+    def flush(self, user_id):
+        key = str(user_id)
+        with self._locks[hash(key) % LOCK_STRIPES]:
+            with self._condition:
+                entry = self._pending.pop(key, None)
+            if not entry:
+                return
+            try:
+                self._apply(key, entry["products"])
+            except Exception:
+                self._restore(key, entry)
+                raise
+
+    def render_stats(self):
+        with self._condition:
+            pending, merged, flushed = len(self._pending), self.merged, self.flushed
+        return [
+            "# TYPE fish_shop_cart_merged_total counter",
+            f"fish_shop_cart_merged_total {merged}",
+            "# TYPE fish_shop_cart_flushes_total counter",
+            f"fish_shop_cart_flushes_total {flushed}",
+            "# TYPE fish_shop_cart_pending gauge",
+            f"fish_shop_cart_pending {pending}",
+        ]
+
+    def _apply(self, key, products):
+        get_or_create_user_cart(self.session, self.api_url, key)
+        for product_id, (quantity, product) in list(products.items()):
+            add_to_cart(self.session, self.api_url, product_id, key, quantity, product=product)
+            del products[product_id]
+        with self._condition:
+            self.flushed += 1
+
+    def _restore(self, key, failed):
+        attempts = failed["attempts"] + 1
+        with self._condition:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = {
+                    "chat_id": failed["chat_id"],
+                    "due_at": time.monotonic() + self.window * 2 ** attempts,
+                    "products": {},
+                    "flushing": False,
+                    "attempts": attempts,
+                }
+                self._pending[key] = entry
+                self._condition.notify()
+            else:
+                entry["attempts"] = max(entry["attempts"], attempts)
+            for product_id, (quantity, product) in failed["products"].items():
+                line = entry["products"].setdefault(product_id, [0, product])
+                line[0] += quantity
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                now = time.monotonic()
+                next_due_at = None
+                for key, entry in self._pending.items():
+                    if entry["flushing"]:
+                        continue
+                    if entry["due_at"] > now:
+                        next_due_at = entry["due_at"]
+                        break
+                    entry["flushing"] = True
+                    self._executor.submit(self._flush_in_background, key, entry["chat_id"])
+                self._condition.wait(None if next_due_at is None else next_due_at - now)
+
+    def _flush_in_background(self, key, chat_id, final=False):
+        try:
+            self.flush(key)
+        except (ServerError, NetworkError) as error:
+            with self._condition:
+                entry = self._pending.get(key)
+                if entry is not None and not final and entry["attempts"] < FLUSH_ATTEMPTS:
+                    logger.warning(f"Не удалось записать корзину пользователя {key}, повтор: {error}")
+                    return
+                self._pending.pop(key, None)
+            logger.error(f"Не удалось записать корзину пользователя {key}: {error}")
+            try:
+                self.outbound.send_message(chat_id=chat_id, text="❌ Не удалось добавить товары в корзину. Попробуйте ещё раз.")
+            except TelegramError as error:
+                logger.error(f"Не удалось отправить сообщение в чат {chat_id}: {error}")
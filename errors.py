@@ -1,7 +1,14 @@
 import logging
+import random
+import time
+from contextvars import ContextVar
 from functools import wraps
 
 import requests
+from metrics import metrics
+from policy import (BudgetExhausted, breaker, deadline, remaining_time,
+                    settings)
+from profiling import profiler
 from telegram.error import BadRequest, RetryAfter, TimedOut, Unauthorized
 from utils import get_update_info
 
@@ -15,24 +22,32 @@ class NetworkError(Exception):
 
 
 logger = logging.getLogger(__name__)
+policy_active = ContextVar("policy_active", default=False)
 
 
-def log_exceptions(func):
+def log_exceptions(func=None, profile=True):
+    if func is None:
+        return lambda func: log_exceptions(func, profile=profile)
+
     @wraps(func)
     def wrapper(update, context, *args, **kwargs):
-        try:
-            return func(update, context, *args, **kwargs)
-        except Exception as e:
-            handle_error(update, context, e)
-            return
+        with metrics.track("handler", func.__name__) as call, deadline(settings.handler_deadline):
+            try:
+                if profile and profiler.sample_rate and profiler.sample():
+                    return profiler.run(func.__name__, func, update, context, *args, **kwargs)
+                return func(update, context, *args, **kwargs)
+            except Exception as e:
+                call.fail(e)
+                handle_error(update, context, e)
+                return
     return wrapper
 
 
-def handle_error(update, context, error):
+def handle_error(update, context, error=None):
+    error = error or context.error
     logger.exception(f"Ошибка при обработке запроса: {error}")
     update_info = get_update_info(update) if update else {}
     query = update_info.get("query")
-    message = update_info.get("message")
     chat_id = update_info.get("chat_id")
 
     error_handlers = {
@@ -50,10 +65,8 @@ def handle_error(update, context, error):
     error_text = "Извините, произошла ошибка. Пожалуйста, попробуйте позже."
     if query:
         query.answer(text=error_text, show_alert=True)
-    elif message:
-        message.reply_text(error_text)
     elif chat_id:
-        context.bot.send_message(chat_id=chat_id, text=error_text)
+        context.bot_data["outbound"].send_message(chat_id=chat_id, text=error_text)
 
     return
 
@@ -61,27 +74,88 @@ def handle_error(update, context, error):
 def handle_error_response(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        try:
-            return func(*args, **kwargs)
+        with metrics.track("strapi", func.__name__):
+            try:
+                return func(*args, **kwargs)
+
+            except (ServerError, NetworkError):
+                raise
 
-        except requests.ConnectionError as conn_err:
-            raise NetworkError(f"Ошибка сети: {conn_err}") from conn_err
+            except requests.ConnectionError as conn_err:
+                raise NetworkError(f"Ошибка сети: {conn_err}") from conn_err
 
-        except requests.HTTPError as http_err:
-            status_code = http_err.response.status_code if http_err.response else None
-            error_messages = {
-                400: "Неправильный запрос",
-                401: "Требуется аутентификация",
-                403: "Доступ запрещен",
-                404: "Ресурс не найден",
-            }
-            error_message = error_messages.get(status_code, "Неизвестная ошибка")
-            raise ServerError(f"Ошибка на стороне сервера: {status_code} - {error_message}") from http_err
+            except requests.HTTPError as http_err:
+                status_code = http_err.response.status_code if http_err.response is not None else None
+                error_messages = {
+                    400: "Неправильный запрос",
+                    401: "Требуется аутентификация",
+                    403: "Доступ запрещен",
+                    404: "Ресурс не найден",
+                }
+                error_message = error_messages.get(status_code, "Неизвестная ошибка")
+                raise ServerError(f"Ошибка на стороне сервера: {status_code} - {error_message}") from http_err
 
-        except requests.RequestException as req_err:
-            raise ServerError(f"Ошибка запроса: {req_err}") from req_err
+            except requests.RequestException as req_err:
+                raise ServerError(f"Ошибка запроса: {req_err}") from req_err
 
-        except Exception as e:
-            raise ServerError("Произошла неизвестная ошибка") from e
+            except Exception as e:
+                raise ServerError("Произошла неизвестная ошибка") from e
 
     return wrapper
+
+
+def strapi_policy(idempotent=False):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if policy_active.get():
+                return func(*args, **kwargs)
+            token = policy_active.set(True)
+            try:
+                return call_with_policy(func, idempotent, *args, **kwargs)
+            finally:
+                policy_active.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+def call_with_policy(func, idempotent, *args, **kwargs):
+    attempts = settings.retries + 1 if idempotent else 1
+    for attempt in range(attempts):
+        if not breaker.allow_call():
+            raise ServerError("Strapi временно недоступен, попробуйте позже")
+        try:
+            result = func(*args, **kwargs)
+        except (ServerError, NetworkError) as error:
+            transient = is_transient_error(error)
+            if transient:
+                breaker.record_failure()
+            elif isinstance(error.__cause__, BudgetExhausted):
+                breaker.release()
+            else:
+                breaker.record_success()
+
+            delay = random.uniform(0, settings.retry_backoff * 2 ** attempt)
+            remaining = remaining_time()
+            if not transient or attempt + 1 == attempts or (remaining is not None and remaining <= delay):
+                raise
+            logger.warning(f"Повторный запрос {func.__name__} через {delay:.2f} с: {error}")
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+def is_transient_error(error):
+    if isinstance(error, NetworkError):
+        return True
+    cause = error.__cause__
+    if isinstance(cause, BudgetExhausted):
+        return False
+    if isinstance(cause, requests.Timeout):
+        return True
+    if isinstance(cause, requests.HTTPError) and cause.response is not None:
+        return cause.response.status_code >= 500 or cause.response.status_code == 429
+    return False
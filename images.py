@@ -0,0 +1,104 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+
+from api import get_image
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    def __init__(self, session, api_url, max_bytes=20 * 1024 * 1024):
+        self.session = session
+        self.api_url = api_url
+        self.max_bytes = max_bytes
+        self._file_ids = {}
+        self._images = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def send_photo(self, bot, chat_id, url_image, **kwargs):
+        file_id = self._file_ids.get(url_image)
+        if file_id:
+            try:
+                return bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            except BadRequest as error:
+                logger.warning(f"Telegram не принял сохранённый file_id для {url_image}: {error}")
+                with self._lock:
+                    self._file_ids.pop(url_image, None)
+
+        message = bot.send_photo(chat_id=chat_id, photo=self.get_bytes(url_image), **kwargs)
+        if message and message.photo:
+            with self._lock:
+                self._file_ids[url_image] = message.photo[-1].file_id
+        return message
+
+    def edit_photo(self, bot, chat_id, message_id, url_image, caption=None, reply_markup=None):
+        file_id = self._file_ids.get(url_image)
+        if file_id:
+            try:
+                return bot.edit_message_media(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    media=InputMediaPhoto(file_id, caption=caption),
+                    reply_markup=reply_markup,
+                )
+            except BadRequest as error:
+                logger.warning(f"Telegram не принял сохранённый file_id для {url_image}: {error}")
+                with self._lock:
+                    self._file_ids.pop(url_image, None)
+
+        message = bot.edit_message_media(
+            chat_id=chat_id,
+            message_id=message_id,
+            media=InputMediaPhoto(self.get_bytes(url_image), caption=caption),
+            reply_markup=reply_markup,
+        )
+        if message and getattr(message, "photo", None):
+            with self._lock:
+                self._file_ids[url_image] = message.photo[-1].file_id
+        return message
+
+    def get_bytes(self, url_image):
+        with self._lock:
+            if url_image in self._images:
+                self._images.move_to_end(url_image)
+                return self._images[url_image]
+
+        content = get_image(self.session, self.api_url, url_image).getvalue()
+        with self._lock:
+            if url_image not in self._images and len(content) <= self.max_bytes:
+                self._images[url_image] = content
+                self._size += len(content)
+                while self._size > self.max_bytes:
+                    _, evicted = self._images.popitem(last=False)
+                    self._size -= len(evicted)
+        return content
+
+    def invalidate(self, url_image):
+        with self._lock:
+            self._file_ids.pop(url_image, None)
+            content = self._images.pop(url_image, None)
+            if content is not None:
+                self._size -= len(content)
+
+    def sync(self, products):
+        actual_urls = {product.image_url for product in products.values()}
+        with self._lock:
+            cached_urls = set(self._file_ids) | set(self._images)
+        for url_image in cached_urls:
+            if url_image not in actual_urls:
+                self.invalidate(url_image)
+
+
+def get_small_image_url(product):
+    return (
+        (product.get("image") or {})
+        .get("formats", {})
+        .get("small", {})
+        .get("url")
+    )
@@ -1,27 +1,40 @@
+from itertools import islice
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 
+QUANTITIES = [1, 2, 5, 10]
+MENU_PAGE_SIZE = 20
+
+
 def get_keyboard_start():
     return InlineKeyboardMarkup([[InlineKeyboardButton("Продукты", callback_data="show_products")],])
 
 
-def get_keyboard_menu(products, count_items):
+def get_keyboard_menu(products, count_items, page=0):
     count_items = f"Моя корзина({count_items})" if count_items else "Моя корзина"
     keyboard_start = []
-    for product in products.values():
+    start = page * MENU_PAGE_SIZE
+    for product in islice(products.values(), start, start + MENU_PAGE_SIZE):
         keyboard_start.append([InlineKeyboardButton(
-            text=f"{product['title']}",
-            callback_data=f"{product['id']}"
+            text=f"{product.title}",
+            callback_data=f"{product.id}"
         )])
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"menu_page_{page - 1}"))
+    if start + MENU_PAGE_SIZE < len(products):
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"menu_page_{page + 1}"))
+    if navigation:
+        keyboard_start.append(navigation)
     keyboard_start.append([InlineKeyboardButton(f"{count_items}", callback_data="my_cart")],)
     return InlineKeyboardMarkup(keyboard_start)
 
 
 def get_keyboard_back(product_id, selected_quantity=1):
-    quantities = [1, 2, 5, 10]
     keyboard = []
     quantity_buttons = []
-    for quantity in quantities:
+    for quantity in QUANTITIES:
         prefix = "✅ " if quantity == selected_quantity else ""
         quantity_buttons.append(
             InlineKeyboardButton(prefix + str(quantity), callback_data=f"quantity_{quantity}")
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LABELS = {"strapi": "function", "handler": "handler", "telegram": "method"}
+
+
+class CallTracker:
+    def __init__(self):
+        self.error = None
+
+    def fail(self, error):
+        self.error = error
+
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._calls = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._in_flight = defaultdict(int)
+        self._latency_buckets = defaultdict(lambda: [0] * len(self.buckets))
+        self._latency_sum = defaultdict(float)
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    @contextmanager
+    def track(self, kind, name):
+        key = (kind, name)
+        tracker = CallTracker()
+        with self._lock:
+            self._in_flight[key] += 1
+        started_at = time.perf_counter()
+        try:
+            yield tracker
+        except Exception as error:
+            tracker.fail(error)
+            raise
+        finally:
+            self._observe(key, time.perf_counter() - started_at, tracker.error)
+
+    def _observe(self, key, duration, error):
+        with self._lock:
+            self._in_flight[key] -= 1
+            self._calls[key] += 1
+            self._latency_sum[key] += duration
+            buckets = self._latency_buckets[key]
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    buckets[index] += 1
+            if error is not None:
+                self._errors[(*key, type(error).__name__, get_status_code(error))] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for kind, label in LABELS.items():
+                prefix = f"fish_shop_{kind}"
+                lines.append(f"# TYPE {prefix}_calls_total counter")
+                for (call_kind, name), value in sorted(self._calls.items()):
+                    if call_kind == kind:
+                        lines.append(f'{prefix}_calls_total{{{label}="{name}"}} {value}')
+
+                lines.append(f"# TYPE {prefix}_errors_total counter")
+                for (call_kind, name, error, status), value in sorted(self._errors.items()):
+                    if call_kind == kind:
+                        lines.append(f'{prefix}_errors_total{{{label}="{name}",error="{error}",status="{status}"}} {value}')
+
+                lines.append(f"# TYPE {prefix}_in_flight gauge")
+                for (call_kind, name), value in sorted(self._in_flight.items()):
+                    if call_kind == kind:
+                        lines.append(f'{prefix}_in_flight{{{label}="{name}"}} {value}')
+
+                lines.append(f"# TYPE {prefix}_latency_seconds histogram")
+                for (call_kind, name), buckets in sorted(self._latency_buckets.items()):
+                    if call_kind != kind:
+                        continue
+                    for bound, value in zip(self.buckets, buckets):
+                        lines.append(f'{prefix}_latency_seconds_bucket{{{label}="{name}",le="{bound}"}} {value}')
+                    count = self._calls[(call_kind, name)]
+                    lines.append(f'{prefix}_latency_seconds_bucket{{{label}="{name}",le="+Inf"}} {count}')
+                    lines.append(f'{prefix}_latency_seconds_sum{{{label}="{name}"}} {self._latency_sum[(call_kind, name)]:.6f}')
+                    lines.append(f'{prefix}_latency_seconds_count{{{label}="{name}"}} {count}')
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self._errors.clear()
+            self._in_flight.clear()
+            self._latency_buckets.clear()
+            self._latency_sum.clear()
+
+
+def get_status_code(error):
+    cause = error.__cause__
+    status_code = getattr(getattr(cause, "response", None), "status_code", None)
+    if status_code is None:
+        status_code = getattr(cause, "status", None)
+    return str(status_code) if status_code is not None else ""
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            content = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Метрики доступны на http://{host}:{server.server_port}/metrics")
+    return server
+
+
+metrics = Metrics()
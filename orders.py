@@ -0,0 +1,217 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from telegram.error import TelegramError
+
+from api import clear_user_cart, create_order
+from errors import NetworkError, ServerError, is_transient_error
+from outbound import BULK
+from policy import breaker
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_cart_key(order_details):
+    return json.dumps(sorted((item["id"], item["quantity"]) for item in order_details.get("cart_items", [])))
+
+
+class OrderQueue:
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS order_jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "user_id TEXT NOT NULL, "
+            "chat_id INTEGER NOT NULL, "
+            "email TEXT NOT NULL, "
+            "cart TEXT NOT NULL, "
+            "cart_key TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'queued', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "order_id TEXT, "
+            "error TEXT, "
+            "next_attempt_at REAL NOT NULL, "
+            "lease_until REAL, "
+            "created_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS order_jobs_active "
+            "ON order_jobs (user_id, cart_key) WHERE status IN ('queued', 'running')"
+        )
+        self._lock = threading.Lock()
+
+    def enqueue(self, user_id, chat_id, email, order_details):
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO order_jobs "
+                "(user_id, chat_id, email, cart, cart_key, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(user_id), chat_id, email, json.dumps(order_details), get_cart_key(order_details), now, now),
+            )
+        return cursor.rowcount == 1
+
+    def claim(self, lease=60, shards=1, shard=0):
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT id, user_id, chat_id, email, cart, attempts, order_id FROM order_jobs "
+                    "WHERE ((status = 'queued' AND next_attempt_at <= ?) OR (status = 'running' AND lease_until < ?)) "
+                    "AND CAST(user_id AS INTEGER) % ? = ? "
+                    "ORDER BY id LIMIT 1",
+                    (now, now, shards, shard),
+                ).fetchone()
+                if row:
+                    self._connection.execute(
+                        "UPDATE order_jobs SET status = 'running', lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                        (now + lease, row[0]),
+                    )
+                self._connection.execute("COMMIT")
+            except sqlite3.Error:
+                self._connection.execute("ROLLBACK")
+                raise
+        if not row:
+            return None
+        job_id, user_id, chat_id, email, cart, attempts, order_id = row
+        return {
+            "id": job_id,
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "email": email,
+            "cart": json.loads(cart),
+            "attempts": attempts + 1,
+            "order_id": order_id,
+        }
+
+    def record_order(self, job_id, order_id):
+        self._update("UPDATE order_jobs SET order_id = ? WHERE id = ?", (order_id, job_id))
+
+    def complete(self, job_id):
+        self._update("UPDATE order_jobs SET status = 'done', lease_until = NULL WHERE id = ?", (job_id,))
+
+    def retry(self, job_id, delay, error):
+        self._update(
+            "UPDATE order_jobs SET status = 'queued', lease_until = NULL, next_attempt_at = ?, error = ? WHERE id = ?",
+            (time.time() + delay, str(error), job_id),
+        )
+
+    def fail(self, job_id, error):
+        self._update(
+            "UPDATE order_jobs SET status = 'failed', lease_until = NULL, error = ? WHERE id = ?",
+            (str(error), job_id),
+        )
+
+    def pending(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM order_jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _update(self, query, parameters):
+        with self._lock:
+            self._connection.execute(query, parameters)
+
+
+class OrderWorkerPool:
+    def __init__(self, orders, session, api_url, outbound, workers=2, max_attempts=5, retry_backoff=2, poll_interval=1, lease=60, shards=1, shard=0):
+        self.orders = orders
+        self.session = session
+        self.api_url = api_url
+        self.outbound = outbound
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.shards = shards
+        self.shard = shard
+        self._wake_up = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"order-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wake_up.set()
+        for thread in self._threads:
+            thread.join()
+        try:
+            pending = self.orders.pending()
+            if pending:
+                logger.info(f"В очереди осталось заказов: {pending}, они будут оформлены после запуска")
+        except sqlite3.Error as error:
+            logger.error(f"Не удалось проверить очередь заказов: {error}")
+        self.orders.close()
+
+    def submit(self, user_id, chat_id, email, order_details):
+        created = self.orders.enqueue(user_id, chat_id, email, order_details)
+        self._wake_up.set()
+        return created
+
+    def _work(self):
+        while not self._stopped.is_set():
+            try:
+                job = self.orders.claim(self.lease, self.shards, self.shard)
+            except sqlite3.Error as error:
+                logger.error(f"Не удалось получить задание на оформление заказа: {error}")
+                job = None
+            if job is None:
+                self._wake_up.wait(self.poll_interval)
+                self._wake_up.clear()
+                continue
+            try:
+                self.process(job)
+            except Exception as error:
+                logger.exception(f"Ошибка при обработке задания на оформление заказа {job['id']}: {error}")
+
+    def process(self, job):
+        try:
+            if not job["order_id"]:
+                job["order_id"] = create_order(self.session, self.api_url, job["user_id"], job["email"], job["cart"])
+                self.orders.record_order(job["id"], job["order_id"])
+        except (ServerError, NetworkError) as error:
+            if (is_transient_error(error) or breaker.is_open) and job["attempts"] < self.max_attempts:
+                delay = self.retry_backoff * 2 ** (job["attempts"] - 1)
+                logger.warning(f"Заказ пользователя {job['user_id']} не оформлен, повтор через {delay} с.: {error}")
+                self.orders.retry(job["id"], delay, error)
+                return
+            logger.error(f"Не удалось оформить заказ пользователя {job['user_id']}: {error}")
+            self.orders.fail(job["id"], error)
+            self.notify(job["chat_id"], "❌ Не удалось оформить заказ. Попробуйте ещё раз: /start")
+            return
+
+        try:
+            clear_user_cart(self.session, self.api_url, job["user_id"], job["cart"]["cart_items"])
+        except (ServerError, NetworkError) as error:
+            logger.error(f"Заказ {job['order_id']} оформлен, но корзину пользователя {job['user_id']} очистить не удалось: {error}")
+        self.orders.complete(job["id"])
+        self.notify(
+            job["chat_id"],
+            "✅ Заказ успешно оформлен!\n"
+            "Скоро с вами свяжется менеджер.\n\n"
+            "Новый заказ: /start",
+        )
+
+    def notify(self, chat_id, text):
+        try:
+            self.outbound.send_message(chat_id=chat_id, text=text, priority=BULK)
+        except TelegramError as error:
+            logger.error(f"Не удалось отправить сообщение о заказе в чат {chat_id}: {error}")
@@ -0,0 +1,164 @@
+import itertools
+import logging
+import threading
+import time
+from functools import partial
+
+from telegram.error import RetryAfter, TimedOut
+
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+INTERACTIVE, BULK = range(2)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now):
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundScheduler:
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, max_wait=30, retries=2, max_chats=10000):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_wait = max_wait
+        self.retries = retries
+        self.max_chats = max_chats
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._paused_until = {}
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+
+    def call(self, chat_id, method, priority=INTERACTIVE):
+        for attempt in range(self.retries + 1):
+            if not self.acquire(chat_id, priority):
+                raise TimedOut(f"Превышено время ожидания отправки в чат {chat_id}")
+            try:
+                return method()
+            except RetryAfter as error:
+                logger.warning(f"Telegram просит подождать {error.retry_after} с. перед отправкой в чат {chat_id}")
+                self.pause(chat_id, error.retry_after)
+                if attempt == self.retries:
+                    raise
+
+    def pause(self, chat_id, seconds):
+        with self._condition:
+            self._paused_until[chat_id] = max(self._paused_until.get(chat_id, 0), time.monotonic() + seconds)
+            self._condition.notify_all()
+
+    def acquire(self, chat_id, priority=INTERACTIVE):
+        ticket = (priority, next(self._tickets), chat_id)
+        give_up_at = time.monotonic() + self.max_wait
+        with self._condition:
+            self._waiting.append(ticket)
+            self._waiting.sort()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._grant(ticket, now)
+                    if wait == 0:
+                        return True
+                    if now + wait > give_up_at:
+                        wait = give_up_at - now
+                        if wait <= 0:
+                            return False
+                    self._condition.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+
+    def queued(self):
+        with self._condition:
+            return len(self._waiting)
+
+    def _grant(self, ticket, now):
+        next_ready = None
+        for waiting in self._waiting:
+            wait = self._chat_wait(waiting[2], now)
+            if wait == 0:
+                break
+            next_ready = wait if next_ready is None else min(next_ready, wait)
+        else:
+            return next_ready
+        if waiting is not ticket:
+            return self._chat_wait(ticket[2], now) or self._global.wait_time(now) or 0.05
+        wait = self._global.wait_time(now)
+        if wait:
+            return wait
+        self._global.take()
+        self._chat_bucket(ticket[2], now).take()
+        return 0
+
+    def _chat_wait(self, chat_id, now):
+        paused_until = self._paused_until.get(chat_id)
+        if paused_until is not None:
+            if paused_until > now:
+                return paused_until - now
+            del self._paused_until[chat_id]
+        return self._chat_bucket(chat_id, now).wait_time(now)
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                self._prune(now)
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self, now):
+        for chat_id, bucket in list(self._chats.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._chats[chat_id]
+
+
+class OutboundBot:
+    def __init__(self, bot, scheduler):
+        self.bot = bot
+        self.scheduler = scheduler
+
+    def _call(self, name, chat_id, priority, **kwargs):
+        with metrics.track("telegram", name):
+            method = partial(getattr(self.bot, name), chat_id=chat_id, **kwargs)
+            return self.scheduler.call(chat_id, method, priority=priority)
+
+    def send_message(self, chat_id, priority=INTERACTIVE, **kwargs):
+        return self._call("send_message", chat_id, priority, **kwargs)
+
+    def send_photo(self, chat_id, priority=INTERACTIVE, **kwargs):
+        return self._call("send_photo", chat_id, priority, **kwargs)
+
+    def edit_message_text(self, chat_id, priority=INTERACTIVE, **kwargs):
+        return self._call("edit_message_text", chat_id, priority, **kwargs)
+
+    def edit_message_reply_markup(self, chat_id, priority=INTERACTIVE, **kwargs):
+        return self._call("edit_message_reply_markup", chat_id, priority, **kwargs)
+
+    def edit_message_caption(self, chat_id, priority=INTERACTIVE, **kwargs):
+        return self._call("edit_message_caption", chat_id, priority, **kwargs)
+
+    def edit_message_media(self, chat_id, priority=INTERACTIVE, **kwargs):
+        return self._call("edit_message_media", chat_id, priority, **kwargs)
+
+    def delete_message(self, chat_id, priority=INTERACTIVE, **kwargs):
+        return self._call("delete_message", chat_id, priority, **kwargs)
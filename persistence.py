@@ -0,0 +1,154 @@
+import json
+import logging
+import sqlite3
+import threading
+from collections import defaultdict
+
+from telegram.ext import BasePersistence
+
+
+logger = logging.getLogger(__name__)
+MISSING_STATE = object()
+
+
+class LazyConversations(dict):
+    def __init__(self, load_state):
+        super().__init__()
+        self._load_state = load_state
+
+    def get(self, key, default=None):
+        state = super().get(key, MISSING_STATE)
+        if state is MISSING_STATE:
+            state = self._load_state(key)
+            self.setdefault(key, state)
+        return default if state is None else state
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, path, flush_interval=5):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS conversations "
+            "(name TEXT NOT NULL, key TEXT NOT NULL, state TEXT NOT NULL, PRIMARY KEY (name, key))"
+        )
+        self._connection.commit()
+        self._db_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending_users = {}
+        self._pending_conversations = {}
+        self._loaded_users = set()
+        self._conversations = {}
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="persistence-flush", daemon=True)
+        self._flusher.start()
+
+    def get_user_data(self):
+        return defaultdict(dict)
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_bot_data(self):
+        return {}
+
+    def get_conversations(self, name):
+        if name not in self._conversations:
+            self._conversations[name] = LazyConversations(lambda key: self._load_state(name, key))
+        return self._conversations[name]
+
+    def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded_users:
+            return
+        with self._pending_lock:
+            pending = self._pending_users.get(user_id)
+        stored = pending if pending is not None else self._load_user_data(user_id)
+        for key, value in stored.items():
+            user_data.setdefault(key, value)
+        self._loaded_users.add(user_id)
+
+    def update_user_data(self, user_id, data):
+        with self._pending_lock:
+            self._pending_users[user_id] = data
+
+    def update_conversation(self, name, key, new_state):
+        if isinstance(new_state, tuple):
+            return
+        with self._pending_lock:
+            self._pending_conversations[(name, key)] = new_state
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+    def update_bot_data(self, data):
+        pass
+
+    def flush(self):
+        with self._pending_lock:
+            users, self._pending_users = self._pending_users, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+        if not users and not conversations:
+            return
+        saved_users = []
+        for user_id, data in users.items():
+            try:
+                saved_users.append((user_id, json.dumps(data)))
+            except (TypeError, ValueError) as error:
+                logger.error(f"Не удалось сохранить данные пользователя {user_id}: {error}")
+        saved_states = [
+            (name, json.dumps(key), json.dumps(state))
+            for (name, key), state in conversations.items() if state is not None
+        ]
+        ended = [(name, json.dumps(key)) for (name, key), state in conversations.items() if state is None]
+        try:
+            with self._db_lock, self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                    saved_users,
+                )
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                    saved_states,
+                )
+                self._connection.executemany("DELETE FROM conversations WHERE name = ? AND key = ?", ended)
+        except sqlite3.Error as error:
+            logger.error(f"Не удалось сохранить состояние пользователей: {error}")
+            with self._pending_lock:
+                self._pending_users = {**users, **self._pending_users}
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+            return
+        logger.debug(f"Сохранено пользователей: {len(users)}, диалогов: {len(conversations)}")
+
+    def close(self):
+        self._stopped.set()
+        self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            self._connection.close()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def _load_user_data(self, user_id):
+        with self._db_lock:
+            row = self._connection.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _load_state(self, name, key):
+        with self._pending_lock:
+            if (name, key) in self._pending_conversations:
+                return self._pending_conversations[(name, key)]
+        with self._db_lock:
+            row = self._connection.execute(
+                "SELECT state FROM conversations WHERE name = ? AND key = ?",
+                (name, json.dumps(key)),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
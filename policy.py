@@ -0,0 +1,101 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import requests
+
+
+class BudgetExhausted(requests.Timeout):
+    pass
+
+
+class PolicySettings:
+    def __init__(self):
+        self.timeout = 5
+        self.handler_deadline = 10
+        self.retries = 2
+        self.retry_backoff = 0.2
+
+
+settings = PolicySettings()
+deadline_at = ContextVar("deadline_at", default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    expires_at = time.monotonic() + seconds
+    current = deadline_at.get()
+    token = deadline_at.set(expires_at if current is None else min(current, expires_at))
+    try:
+        yield
+    finally:
+        deadline_at.reset(token)
+
+
+def remaining_time():
+    expires_at = deadline_at.get()
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
+
+
+def request_timeout(default=None):
+    timeout = default or settings.timeout
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise BudgetExhausted("Исчерпан бюджет времени на обработку запроса")
+    return min(timeout, remaining)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def release(self):
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+breaker = CircuitBreaker()
+
+
+def configure_policy(timeout, handler_deadline, retries, failure_threshold, reset_timeout):
+    settings.timeout = timeout
+    settings.handler_deadline = handler_deadline
+    settings.retries = retries
+    breaker.failure_threshold = failure_threshold
+    breaker.reset_timeout = reset_timeout
@@ -0,0 +1,101 @@
+import cProfile
+import itertools
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+
+
+logger = logging.getLogger(__name__)
+
+
+class Profiler:
+    def __init__(self):
+        self.sample_rate = 0
+        self.directory = "profiles"
+        self.keep = 100
+        self.trace_memory = False
+        self.top = 30
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        return random.random() < self.sample_rate
+
+    def run(self, name, func, *args, **kwargs):
+        if not self._lock.acquire(blocking=False):
+            return func(*args, **kwargs)
+        try:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                return func(*args, **kwargs)
+            trace_memory = self.trace_memory and not tracemalloc.is_tracing()
+            if trace_memory:
+                tracemalloc.start()
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                duration = time.perf_counter() - started_at
+                snapshot = None
+                if trace_memory:
+                    snapshot = tracemalloc.take_snapshot()
+                    tracemalloc.stop()
+                self.dump(name, profile, snapshot, duration)
+        finally:
+            self._lock.release()
+
+    def dump(self, name, profile, snapshot, duration):
+        stem = os.path.join(
+            self.directory,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._sequence):06d}-{name}-{duration * 1000:.0f}ms",
+        )
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(f"{stem}.prof")
+            with open(f"{stem}.txt", "w") as report:
+                report.write(f"{name}: {duration * 1000:.1f} мс\n\n")
+                pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(self.top)
+                if snapshot:
+                    report.write("Крупнейшие выделения памяти:\n")
+                    for statistic in snapshot.statistics("lineno")[:self.top]:
+                        report.write(f"{statistic}\n")
+            self.rotate()
+        except OSError as error:
+            logger.error(f"Не удалось сохранить профиль {name}: {error}")
+
+    def rotate(self):
+        with os.scandir(self.directory) as entries:
+            files = sorted(
+                (entry for entry in entries if entry.name.endswith((".prof", ".txt"))),
+                key=lambda entry: entry.stat().st_mtime,
+            )
+        stems = list(dict.fromkeys(os.path.splitext(entry.path)[0] for entry in files))
+        for stem in stems[:max(0, len(stems) - self.keep)]:
+            for extension in (".prof", ".txt"):
+                try:
+                    os.remove(stem + extension)
+                except FileNotFoundError:
+                    pass
+
+    def status(self):
+        if not self.sample_rate:
+            return "Профилирование выключено"
+        memory = "с памятью" if self.trace_memory else "без памяти"
+        return f"Профилирование включено: доля {self.sample_rate}, {memory}, каталог {self.directory}"
+
+
+profiler = Profiler()
+
+
+def configure_profiling(sample_rate, directory, keep, trace_memory):
+    profiler.directory = directory
+    profiler.keep = keep
+    profiler.trace_memory = trace_memory
+    profiler.sample_rate = sample_rate
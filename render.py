@@ -0,0 +1,83 @@
+import math
+import threading
+
+from telegram import InlineKeyboardMarkup
+
+from keyboards import MENU_PAGE_SIZE, get_keyboard_back, get_keyboard_menu
+
+
+class FrozenKeyboard(InlineKeyboardMarkup):
+    __slots__ = ("_json",)
+
+    def __init__(self, inline_keyboard, **kwargs):
+        super().__init__(inline_keyboard, **kwargs)
+        self._json = super().to_json()
+
+    def to_json(self):
+        return self._json
+
+
+def freeze(markup):
+    return FrozenKeyboard(markup.inline_keyboard)
+
+
+def get_product_caption(product):
+    return f"{product.title} ({product.price} руб. за кг.)\n\n{product.description}"
+
+
+class RenderedCatalog:
+    __slots__ = ("version", "products", "menus", "product_keyboards", "captions")
+
+    def __init__(self, version, products):
+        self.version = version
+        self.products = products
+        self.menus = {}
+        self.product_keyboards = {}
+        self.captions = {
+            product_id: get_product_caption(product)
+            for product_id, product in products.items()
+        }
+
+
+class RenderCache:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._rendered = None
+        self._lock = threading.Lock()
+
+    def menu_keyboard(self, count_items, page=0):
+        rendered = self._sync()
+        products = rendered.products
+        page = min(max(page, 0), max(math.ceil(len(products) / MENU_PAGE_SIZE) - 1, 0))
+        keyboard = rendered.menus.get((count_items, page))
+        if keyboard is None:
+            keyboard = freeze(get_keyboard_menu(products, count_items, page))
+            rendered.menus[(count_items, page)] = keyboard
+        return keyboard
+
+    def product_keyboard(self, product_id, selected_quantity=1):
+        rendered = self._sync()
+        keyboard = rendered.product_keyboards.get((product_id, selected_quantity))
+        if keyboard is None:
+            keyboard = freeze(get_keyboard_back(product_id, selected_quantity))
+            rendered.product_keyboards[(product_id, selected_quantity)] = keyboard
+        return keyboard
+
+    def caption(self, product):
+        rendered = self._sync()
+        caption = rendered.captions.get(product.id)
+        if caption is None:
+            caption = get_product_caption(product)
+            rendered.captions[product.id] = caption
+        return caption
+
+    def _sync(self):
+        snapshot = self.catalog.snapshot()
+        rendered = self._rendered
+        if rendered is None or rendered.version < snapshot.version:
+            with self._lock:
+                rendered = self._rendered
+                if rendered is None or rendered.version < snapshot.version:
+                    rendered = RenderedCatalog(snapshot.version, snapshot.products)
+                    self._rendered = rendered
+        return rendered
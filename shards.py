@@ -0,0 +1,227 @@
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+from metrics import metrics
+from webhook import (UpdateWorkerPool, WebhookListener, get_raw_update_user_id,
+                     stop_dispatcher, wait_for_stop_signal)
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_shard(data, shards):
+    user_id = get_raw_update_user_id(data)
+    key = user_id if user_id is not None else data.get("update_id", 0)
+    return int(key) % shards
+
+
+def run_shard(create_dispatcher, shard_index, shards, updates, processed, workers, queue_size):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    dispatcher = create_dispatcher(shard_index, shards)
+
+    def count_processed():
+        with processed.get_lock():
+            processed[shard_index] += 1
+
+    pool = UpdateWorkerPool(
+        dispatcher,
+        workers=workers,
+        queue_size=queue_size,
+        on_processed=count_processed,
+        shards=shards,
+    )
+    pool.start()
+    while True:
+        data = updates.get()
+        if data is None:
+            break
+        while not pool.submit(data):
+            time.sleep(0.01)
+    pool.stop()
+    stop_dispatcher(dispatcher)
+
+
+class ShardSupervisor:
+    def __init__(self, create_dispatcher, shards, workers=4, queue_size=100, stats_interval=60, restart_delay=1):
+        self.create_dispatcher = create_dispatcher
+        self.shards = shards
+        self.workers = workers
+        self.queue_size = queue_size
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue(maxsize=queue_size) for _ in range(shards)]
+        self.processed = self._context.Array("q", shards)
+        self.routed = [0] * shards
+        self.rejected = [0] * shards
+        self.restarts = [0] * shards
+        self._processes = [None] * shards
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._monitor = None
+
+    def start(self):
+        for shard_index in range(self.shards):
+            self._start_shard(shard_index)
+        self._monitor = threading.Thread(target=self._watch, name="shard-supervisor", daemon=True)
+        self._monitor.start()
+        metrics.add_collector(self.render_stats)
+        return self
+
+    def stop(self, timeout=10):
+        self._stopped.set()
+        if self._monitor:
+            self._monitor.join()
+        for updates in self.queues:
+            updates.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Шард {process.name} не остановился вовремя и будет завершён")
+                process.kill()
+
+    def submit(self, data, block=False, timeout=None):
+        shard_index = get_shard(data, self.shards)
+        try:
+            self.queues[shard_index].put(data, block=block, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected[shard_index] += 1
+            return False
+        with self._lock:
+            self.routed[shard_index] += 1
+        return True
+
+    def stats(self):
+        return [
+            {
+                "shard": shard_index,
+                "alive": self._processes[shard_index].is_alive(),
+                "routed": self.routed[shard_index],
+                "processed": self.processed[shard_index],
+                "rejected": self.rejected[shard_index],
+                "queued": self.queues[shard_index].qsize(),
+                "restarts": self.restarts[shard_index],
+            }
+            for shard_index in range(self.shards)
+        ]
+
+    def render_stats(self):
+        lines = []
+        stats = self.stats()
+        for name, kind in (("processed", "counter"), ("rejected", "counter"), ("restarts", "counter"), ("queued", "gauge")):
+            metric = f"fish_shop_shard_{name}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# TYPE {metric} {kind}")
+            for shard in stats:
+                lines.append(f'{metric}{{shard="{shard["shard"]}"}} {shard[name]}')
+        return lines
+
+    def _start_shard(self, shard_index):
+        process = self._context.Process(
+            target=run_shard,
+            args=(
+                self.create_dispatcher,
+                shard_index,
+                self.shards,
+                self.queues[shard_index],
+                self.processed,
+                self.workers,
+                self.queue_size,
+            ),
+            name=f"shard-{shard_index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[shard_index] = process
+        logger.info(f"Запущен шард {shard_index}, pid {process.pid}")
+
+    def _restart_shard(self, shard_index, exitcode):
+        broken_queue = self.queues[shard_index]
+        self.queues[shard_index] = self._context.Queue(maxsize=self.queue_size)
+        lost = broken_queue.qsize()
+        broken_queue.cancel_join_thread()
+        broken_queue.close()
+        logger.error(
+            f"Шард {shard_index} завершился с кодом {exitcode}, перезапуск; "
+            f"потеряно обновлений из очереди: {lost}"
+        )
+        self.restarts[shard_index] += 1
+        self._start_shard(shard_index)
+
+    def _watch(self):
+        last_report_at = time.monotonic()
+        last_processed = list(self.processed)
+        while not self._stopped.wait(self.restart_delay):
+            for shard_index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    self._restart_shard(shard_index, process.exitcode)
+            now = time.monotonic()
+            if now - last_report_at >= self.stats_interval:
+                processed = list(self.processed)
+                for shard in self.stats():
+                    shard_index = shard["shard"]
+                    rate = (processed[shard_index] - last_processed[shard_index]) / (now - last_report_at)
+                    logger.info(
+                        f"Шард {shard_index}: {rate:.1f} обновлений/с, обработано {shard['processed']}, "
+                        f"в очереди {shard['queued']}, отклонено {shard['rejected']}, перезапусков {shard['restarts']}"
+                    )
+                last_report_at, last_processed = now, processed
+
+
+def poll_updates(bot, submit, stopped, timeout=30):
+    bot.delete_webhook()
+    offset = None
+    while not stopped.is_set():
+        try:
+            updates = bot.get_updates(offset=offset, timeout=timeout, allowed_updates=["message", "callback_query"])
+        except Exception as error:
+            logger.warning(f"Не удалось получить обновления: {error}")
+            time.sleep(1)
+            continue
+        for update in updates:
+            while not submit(update.to_dict(), block=True, timeout=1):
+                if stopped.is_set():
+                    return
+            offset = update.update_id + 1
+
+
+def run_sharded(bot, create_dispatcher, shards, bot_mode="polling", webhook_settings=None, workers=4, queue_size=100, stats_interval=60):
+    supervisor = ShardSupervisor(
+        create_dispatcher,
+        shards,
+        workers=workers,
+        queue_size=queue_size,
+        stats_interval=stats_interval,
+    ).start()
+    stopped = threading.Event()
+    listener = None
+    try:
+        if bot_mode == "webhook":
+            settings = dict(webhook_settings)
+            webhook_url = settings.pop("webhook_url", None)
+            listener = WebhookListener(supervisor.submit, **settings).start()
+            if webhook_url:
+                bot.set_webhook(
+                    url=f"{webhook_url.rstrip('/')}{settings['url_path']}",
+                    max_connections=min(100, workers * shards),
+                    secret_token=settings.get("secret_token"),
+                )
+        else:
+            threading.Thread(
+                target=poll_updates,
+                args=(bot, supervisor.submit, stopped),
+                name="shard-polling",
+                daemon=True,
+            ).start()
+        wait_for_stop_signal()
+        logger.info("Остановка шардов")
+    finally:
+        stopped.set()
+        if listener:
+            listener.stop()
+        supervisor.stop()
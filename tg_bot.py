@@ -3,19 +3,35 @@ import re
 
 from environs import Env
 
+from telegram import Bot
 from telegram.error import TelegramError
 from telegram.ext import (CallbackQueryHandler, CommandHandler,
-                          ConversationHandler, Filters, MessageHandler,
-                          Updater)
+                          ConversationHandler, Dispatcher, Filters,
+                          MessageHandler, Updater)
+from telegram.utils.request import Request
 
 from errors import handle_error, log_exceptions
-from utils import get_api_context, get_update_info
-from api import (add_to_cart, clear_user_cart, create_order, 
-                 get_display_cart, get_image, get_or_create_user_cart, 
-                 get_products, get_user_cart_with_items, init_strapi_session,
-                 remove_from_cart)
-from keyboards import (get_keyboard_back, get_keyboard_cart, get_keyboard_menu,
-                       get_keyboard_start)
+from utils import (get_api_context, get_cart_coalescer, get_catalog,
+                   get_orders, get_outbound, get_render_cache,
+                   get_update_info, get_views)
+from api import (get_display_cart, get_user_cart_with_items,
+                 init_strapi_session, remove_from_cart)
+from async_api import init_async_strapi_session
+from carts import cart_cache
+from catalog import CatalogCache
+from coalescer import CartCoalescer
+from images import ImageCache
+from metrics import start_metrics_server
+from orders import OrderQueue, OrderWorkerPool
+from outbound import OutboundBot, OutboundScheduler
+from persistence import SQLitePersistence
+from policy import configure_policy
+from profiling import configure_profiling, profiler
+from render import RenderCache
+from shards import run_sharded
+from views import ViewTracker
+from webhook import run_webhook, stop_dispatcher
+from keyboards import get_keyboard_cart, get_keyboard_start
 
 
 logger = logging.getLogger(__name__)
@@ -24,11 +40,8 @@ HANDLE_MAIN, WAITING_EMAIL = range(2)
 
 @log_exceptions
 def handle_start(update, context):
-    session, api_url = get_api_context(context)
-    products = get_products(session, api_url)
-    context.user_data["products"] = products
     text = "Приветствую! 🐟.\n Добро пожаловать в интернет-магазин свежей рыбы"
-    update.message.reply_text(text, reply_markup=get_keyboard_start())
+    get_views(context).send_text(update.message.chat_id, text, reply_markup=get_keyboard_start())
 
     return HANDLE_MAIN
 
@@ -40,45 +53,37 @@ def handle_menu(update, context):
     update_info = get_update_info(update)
     user_id = update_info.get("user_id")
     chat_id = update_info.get("chat_id")
-    message_id = update_info.get("message_id")
-
-    context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-
-    products = get_products(session, api_url)
-    context.user_data["products"] = products
+    query = update_info.get("query")
+    page = 0
+    if query and query.data.startswith("menu_page_"):
+        page = int(query.data[len("menu_page_"):])
 
     cart_items = get_user_cart_with_items(session, api_url, user_id)
-    count_items = get_display_cart(cart_items).get("count_items") if cart_items else 0
+    count_items = get_cart_coalescer(context).count_items(user_id, cart_items)
 
     text = "🏷️ Наши продукты:\nВыберите рыбу:"
-    keyboard = get_keyboard_menu(products, count_items)
-    context.bot.send_message(chat_id=chat_id, text=text, reply_markup=keyboard)
+    keyboard = get_render_cache(context).menu_keyboard(count_items, page)
+    get_views(context).show_text(chat_id, text, reply_markup=keyboard, message=query.message if query else None)
     return HANDLE_MAIN
 
 
 @log_exceptions
 def handle_show_product(update, context):
-    session, api_url = get_api_context(context)
     update_info = get_update_info(update)
-    chat_id, message_id = update_info.get("chat_id"), update_info.get("message_id")
-    products = context.user_data["products"]
+    chat_id, query = update_info.get("chat_id"), update_info.get("query")
     user_reply = context.user_data["user_reply"]
-    product = products.get(int(user_reply))
-    url_image = (
-        product.get("image", {})
-        .get("formats", {})
-        .get("small", {})
-        .get("url")
-    )
-    context.user_data["product_id"] = product.get("id")
-    image_data = get_image(session, api_url, url_image)
-    text = f"{product.get('title')} ({product.get('price')} руб. за кг.)\n\n{product.get('description')}"
-    context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-    context.bot.send_photo(
-        chat_id=chat_id,
-        photo=image_data,
-        caption=text,
-        reply_markup=get_keyboard_back(product.get("id"))
+    product = get_catalog(context).get(int(user_reply))
+    if product is None:
+        query.answer("Каталог обновился, выберите товар заново", show_alert=True)
+        return handle_menu(update, context)
+    context.user_data["product_id"] = product.id
+    render = get_render_cache(context)
+    get_views(context).show_photo(
+        chat_id,
+        product.image_url,
+        caption=render.caption(product),
+        reply_markup=render.product_keyboard(product.id),
+        message=query.message,
     )
 
     return HANDLE_MAIN
@@ -89,18 +94,19 @@ def handle_my_cart(update, context):
     session, api_url = get_api_context(context)
     update_info = get_update_info(update)
     user_id = update_info.get("user_id")
-    query = update_info.get("query")
+    chat_id, query = update_info.get("chat_id"), update_info.get("query")
 
+    get_cart_coalescer(context).flush(user_id)
     cart_items = get_user_cart_with_items(session, api_url, user_id)
     keyboard = get_keyboard_cart(cart_items)
 
     if not cart_items or not cart_items.get('cart_items', []):
-        query.edit_message_text(text="🛒 Ваша корзина пуста", reply_markup=keyboard)
+        get_views(context).show_text(chat_id, "🛒 Ваша корзина пуста", reply_markup=keyboard, message=query.message)
         return HANDLE_MAIN
 
     cart_display = get_display_cart(cart_items).get("cart_display")
 
-    query.edit_message_text(text=cart_display, reply_markup=keyboard)
+    get_views(context).show_text(chat_id, cart_display, reply_markup=keyboard, message=query.message)
 
     return HANDLE_MAIN
 
@@ -113,30 +119,31 @@ def handle_email(update, context):
     chat_id = update_info.get("chat_id")
 
     if not message:
-        context.bot.send_message(chat_id=chat_id, text="📧 Введите ваш email для оформления заказа:")
+        get_outbound(context).send_message(chat_id=chat_id, text="📧 Введите ваш email для оформления заказа:")
         return WAITING_EMAIL
 
     email = message.text.strip()
 
     if not re.match(r"[\w\.-]+@[\w\.-]+\.\w+", email):
-        update.message.reply_text("❌ Неверный формат email. Попробуйте снова:")
+        get_outbound(context).send_message(chat_id=chat_id, text="❌ Неверный формат email. Попробуйте снова:")
         return WAITING_EMAIL
 
     session, api_url = get_api_context(context)
-    order_details = get_user_cart_with_items(session, api_url, user_id)
+    get_cart_coalescer(context).flush(user_id)
+    order_details = get_user_cart_with_items(session, api_url, user_id, use_cache=False)
 
-    if create_order(session, api_url, user_id, email, order_details):
-        update.message.reply_text(
-                "✅ Заказ успешно оформлен!\n"
-                "Скоро с вами свяжется менеджер.\n\n"
-                "Новый заказ: /start",
-            )
-        clear_user_cart(session, api_url, user_id)
-        return ConversationHandler.END
-    else:
-        update.message.reply_text("Не удалось оформить заказ.")
+    if not order_details or not order_details.get("cart_items"):
+        get_outbound(context).send_message(chat_id=chat_id, text="🛒 Ваша корзина пуста")
         return HANDLE_MAIN
 
+    get_orders(context).submit(user_id, chat_id, email, order_details)
+    get_outbound(context).send_message(
+            chat_id=chat_id,
+            text="✅ Заказ принят! Подтверждение придёт отдельным сообщением.\n\n"
+            "Новый заказ: /start",
+        )
+    return ConversationHandler.END
+
 
 @log_exceptions
 def handle_quantity_selection(update, context):
@@ -147,26 +154,31 @@ def handle_quantity_selection(update, context):
     context.user_data["quantity"] = quantity
     product_id = context.user_data.get("product_id")
 
-    keyboard = get_keyboard_back(product_id, quantity)
+    keyboard = get_render_cache(context).product_keyboard(product_id, quantity)
     query_quantity.answer(text=f"Выбрано: {quantity} кг", show_alert=False)
 
-    if query_quantity.message.reply_markup != keyboard:
-        query_quantity.edit_message_reply_markup(reply_markup=keyboard)
+    get_views(context).show_keyboard(update_info.get("chat_id"), keyboard, query_quantity.message)
 
     return HANDLE_MAIN
 
 
 @log_exceptions
 def handle_add_to_cart(update, context):
-    session, api_url = get_api_context(context)
     update_info = get_update_info(update)
     user_id = update_info.get("user_id")
     query = update_info.get("query")
     quantity = context.user_data.get("quantity", 1)
     product_id = context.user_data["product_id"]
 
-    get_or_create_user_cart(session, api_url, user_id)
-    add_to_cart(session, api_url, product_id, user_id, quantity)
+    product = get_catalog(context).get(product_id)
+
+    get_cart_coalescer(context).add(
+        user_id,
+        update_info.get("chat_id"),
+        product_id,
+        quantity,
+        product=product.as_dict() if product else None,
+    )
 
     query.answer(text=f"✅ Добавлено в корзину: {quantity} кг.", show_alert=True)
 
@@ -180,23 +192,19 @@ def handle_remove_product(update, context):
     query = update_info.get("query")
     user_id = update_info.get("user_id")
     cart_item_id = context.user_data["cart_item_id"]
-    remove_from_cart(session, api_url, cart_item_id)
+    get_cart_coalescer(context).flush(user_id)
+    remove_from_cart(session, api_url, cart_item_id, user_id)
     cart_items = get_user_cart_with_items(session, api_url, user_id)
     cart_display = get_display_cart(cart_items).get("cart_display")
     keyboard = get_keyboard_cart(cart_items)
 
-    old_text = query.message.text
-    old_reply_markup = query.message.reply_markup
-    keyboard_changed = old_reply_markup != keyboard
-    text_changed = old_text != cart_display
-    if text_changed or keyboard_changed:
-        query.edit_message_text(text=cart_display, reply_markup=keyboard)
+    get_views(context).show_text(update_info.get("chat_id"), cart_display, reply_markup=keyboard, message=query.message)
 
     query.answer(text="🗑️ Товар удален из корзины!", show_alert=False)
     return HANDLE_MAIN
 
 
-@log_exceptions
+@log_exceptions(profile=False)
 def handle_description_reply(update, context):
     update_info = get_update_info(update)
     query = update_info.get("query")
@@ -209,6 +217,7 @@ def handle_description_reply(update, context):
             "quantity_": handle_quantity_selection,
             "my_cart": handle_my_cart,
             "show_products": handle_menu,
+            "menu_page_": handle_menu,
             "pay": handle_email
         }
     for prefix, handler in handlers.items():
@@ -228,6 +237,163 @@ def handle_description_reply(update, context):
 
 
 
+@log_exceptions
+def handle_profile(update, context):
+    update_info = get_update_info(update)
+    if int(update_info.get("user_id")) not in context.bot_data["admin_ids"]:
+        return
+    if context.args:
+        try:
+            sample_rate = 0 if context.args[0] == "off" else float(context.args[0])
+        except ValueError:
+            get_outbound(context).send_message(
+                chat_id=update_info.get("chat_id"),
+                text="Использование: /profile <доля от 0 до 1> [memory] или /profile off",
+            )
+            return
+        profiler.trace_memory = "memory" in context.args[1:]
+        profiler.sample_rate = min(1, max(0, sample_rate))
+        logger.info(f"Администратор {update_info.get('user_id')} изменил профилирование: {profiler.status()}")
+    get_outbound(context).send_message(chat_id=update_info.get("chat_id"), text=profiler.status())
+
+
+def get_conversation_handler(persistent=False):
+    return ConversationHandler(
+        entry_points=[CommandHandler("start", handle_start)],
+        states={
+            HANDLE_MAIN: [
+                CallbackQueryHandler(handle_description_reply),
+            ],
+            WAITING_EMAIL: [
+                MessageHandler(Filters.text & ~Filters.command, handle_email),
+            ],
+        },
+        fallbacks=[CommandHandler("start", handle_start)],
+        name="fish_shop",
+        persistent=persistent,
+    )
+
+
+def create_persistence(env):
+    persistence_path = env.str("PERSISTENCE_PATH", None)
+    persistence_flush_interval = env.float("PERSISTENCE_FLUSH_INTERVAL", 5)
+    if not persistence_path:
+        return None
+    return SQLitePersistence(persistence_path, flush_interval=persistence_flush_interval)
+
+
+def setup_dispatcher(dispatcher, env, shards=1, shard_index=0):
+    strapi_token = env.str("STRAPI_API_TOKEN")
+    api_url = env.str("STRAPI_URL")
+    catalog_ttl = env.int("CATALOG_TTL", 300)
+    catalog_delta_sync = env.bool("CATALOG_DELTA_SYNC", False)
+    catalog_id_check_interval = env.int("CATALOG_ID_CHECK_INTERVAL", 600)
+    catalog_snapshot_path = env.str("CATALOG_SNAPSHOT_PATH", "catalog_snapshot.json")
+    image_cache_mb = env.int("IMAGE_CACHE_MB", 20)
+    strapi_async = env.bool("STRAPI_ASYNC", False)
+    strapi_pool_size = env.int("STRAPI_POOL_SIZE", 20)
+    strapi_timeout = env.float("STRAPI_TIMEOUT", 5)
+    cart_cache_size = env.int("CART_CACHE_SIZE", 10000)
+    cart_cache_max_age = env.int("CART_CACHE_MAX_AGE", 60)
+    handler_deadline = env.float("HANDLER_DEADLINE", 10)
+    strapi_retries = env.int("STRAPI_RETRIES", 2)
+    breaker_failures = env.int("BREAKER_FAILURES", 5)
+    breaker_reset = env.float("BREAKER_RESET", 30)
+    metrics_port = env.int("METRICS_PORT", 0)
+    metrics_host = env.str("METRICS_HOST", "127.0.0.1")
+    tg_global_rate = env.float("TG_GLOBAL_RATE", 30)
+    tg_chat_rate = env.float("TG_CHAT_RATE", 1)
+    tg_chat_burst = env.int("TG_CHAT_BURST", 3)
+    order_queue_path = env.str("ORDER_QUEUE_PATH", "orders.sqlite3")
+    order_workers = env.int("ORDER_WORKERS", 2)
+    cart_coalesce_window = env.float("CART_COALESCE_WINDOW", 0.5)
+    admin_ids = env.list("ADMIN_IDS", [], subcast=int)
+    profile_sample_rate = env.float("PROFILE_SAMPLE_RATE", 0)
+    profile_dir = env.str("PROFILE_DIR", "profiles")
+    profile_keep = env.int("PROFILE_KEEP", 100)
+    profile_tracemalloc = env.bool("PROFILE_TRACEMALLOC", False)
+
+    configure_policy(
+        timeout=strapi_timeout,
+        handler_deadline=handler_deadline,
+        retries=strapi_retries,
+        failure_threshold=breaker_failures,
+        reset_timeout=breaker_reset,
+    )
+    configure_profiling(
+        sample_rate=profile_sample_rate,
+        directory=profile_dir,
+        keep=profile_keep,
+        trace_memory=profile_tracemalloc,
+    )
+    if strapi_async:
+        strapi_session = init_async_strapi_session(
+            strapi_token,
+            api_url,
+            pool_size=strapi_pool_size,
+            timeout=strapi_timeout,
+        )
+    else:
+        strapi_session = init_strapi_session(token=strapi_token)
+    dispatcher.bot_data["strapi_session"] = strapi_session
+    dispatcher.bot_data["api_url"] = api_url
+    catalog = CatalogCache(
+        strapi_session,
+        api_url,
+        ttl=catalog_ttl,
+        delta_sync=catalog_delta_sync,
+        id_check_interval=catalog_id_check_interval,
+        snapshot_path=catalog_snapshot_path or None,
+    )
+    images = ImageCache(strapi_session, api_url, max_bytes=image_cache_mb * 1024 * 1024)
+    catalog.subscribe(images.sync)
+    catalog.warm_up()
+    dispatcher.bot_data["catalog"] = catalog
+    dispatcher.bot_data["images"] = images
+    dispatcher.bot_data["render"] = RenderCache(catalog)
+    dispatcher.bot_data["outbound"] = OutboundBot(
+        dispatcher.bot,
+        OutboundScheduler(global_rate=tg_global_rate / shards, chat_rate=tg_chat_rate, chat_burst=tg_chat_burst),
+    )
+    dispatcher.bot_data["cart_coalescer"] = CartCoalescer(
+        strapi_session,
+        api_url,
+        dispatcher.bot_data["outbound"],
+        window=cart_coalesce_window,
+    ).start()
+    dispatcher.bot_data["orders"] = OrderWorkerPool(
+        OrderQueue(order_queue_path),
+        strapi_session,
+        api_url,
+        dispatcher.bot_data["outbound"],
+        workers=order_workers,
+        shards=shards,
+        shard=shard_index - 1 if shards > 1 else 0,
+    ).start()
+    dispatcher.bot_data["views"] = ViewTracker(dispatcher.bot_data["outbound"], images).start()
+    cart_cache.configure(max_size=cart_cache_size, max_age=cart_cache_max_age)
+    if metrics_port:
+        start_metrics_server(metrics_port + shard_index, host=metrics_host)
+    dispatcher.add_error_handler(handle_error)
+    dispatcher.bot_data["admin_ids"] = set(admin_ids)
+    dispatcher.add_handler(CommandHandler("profile", handle_profile), group=-1)
+    dispatcher.add_handler(get_conversation_handler(persistent=dispatcher.persistence is not None))
+
+
+def create_shard_dispatcher(shard_index, shards):
+    logging.basicConfig(
+        format=f"%(asctime)s - shard {shard_index} - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO
+    )
+    env = Env()
+    env.read_env()
+    update_workers = env.int("UPDATE_WORKERS", 4)
+    bot = Bot(env.str("TG_TOKEN"), request=Request(con_pool_size=update_workers + 4))
+    dispatcher = Dispatcher(bot, None, workers=0, persistence=create_persistence(env))
+    setup_dispatcher(dispatcher, env, shards=shards, shard_index=shard_index + 1)
+    return dispatcher
+
+
 def main():
     logging.basicConfig(
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -235,32 +401,49 @@ def main():
     )
     env = Env()
     env.read_env()
-    strapi_token = env.str("STRAPI_API_TOKEN")
-    api_url = env.str("STRAPI_URL")
+    bot_mode = env.str("BOT_MODE", "polling")
+    update_workers = env.int("UPDATE_WORKERS", 4)
+    update_queue_size = env.int("UPDATE_QUEUE_SIZE", 100)
+    shards = env.int("SHARDS", 1)
+    shard_stats_interval = env.float("SHARD_STATS_INTERVAL", 60)
 
     tg_token = env.str("TG_TOKEN")
-    updater = Updater(tg_token)
-    dispatcher = updater.dispatcher
     try:
-        strapi_session = init_strapi_session(token=strapi_token)
-        dispatcher.bot_data["strapi_session"] = strapi_session
-        dispatcher.bot_data["api_url"] = api_url
-        dispatcher.add_error_handler(handle_error)
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("start", handle_start)],
-            states={
-                HANDLE_MAIN: [
-                    CallbackQueryHandler(handle_description_reply),
-                ],
-                WAITING_EMAIL: [
-                    MessageHandler(Filters.text & ~Filters.command, handle_email),
-                ],
-            },
-            fallbacks=[CommandHandler("start", handle_start)],
+        if shards > 1:
+            metrics_port = env.int("METRICS_PORT", 0)
+            if metrics_port:
+                start_metrics_server(metrics_port, host=env.str("METRICS_HOST", "127.0.0.1"))
+            run_sharded(
+                Bot(tg_token),
+                create_shard_dispatcher,
+                shards=shards,
+                bot_mode=bot_mode,
+                webhook_settings=get_webhook_settings(env),
+                workers=update_workers,
+                queue_size=update_queue_size,
+                stats_interval=shard_stats_interval,
+            )
+            return
+
+        updater = Updater(
+            tg_token,
+            workers=update_workers,
+            request_kwargs={"con_pool_size": update_workers + 4},
+            persistence=create_persistence(env),
         )
-        dispatcher.add_handler(conv_handler)
-        updater.start_polling()
-        updater.idle()   
+        dispatcher = updater.dispatcher
+        setup_dispatcher(dispatcher, env)
+        if bot_mode == "webhook":
+            run_webhook(
+                dispatcher,
+                **get_webhook_settings(env),
+                workers=update_workers,
+                queue_size=update_queue_size,
+            )
+        else:
+            updater.start_polling()
+            updater.idle()   
+            stop_dispatcher(dispatcher)
 
     except TelegramError as error:
         logger.exception(f"Ошибка Telegram: {error}")
@@ -268,6 +451,16 @@ def main():
         logger.exception(f"Ошибка: {error}")
 
 
+def get_webhook_settings(env):
+    return {
+        "host": env.str("WEBHOOK_LISTEN", "127.0.0.1"),
+        "port": env.int("WEBHOOK_PORT", 8443),
+        "url_path": env.str("WEBHOOK_PATH", "/webhook"),
+        "webhook_url": env.str("WEBHOOK_URL", None),
+        "secret_token": env.str("WEBHOOK_SECRET", None),
+    }
+
+
 if __name__ == "__main__":
     main()
 
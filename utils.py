@@ -2,6 +2,30 @@ def get_api_context(context):
     return context.bot_data['strapi_session'], context.bot_data['api_url']
 
 
+def get_cart_coalescer(context):
+    return context.bot_data['cart_coalescer']
+
+
+def get_catalog(context):
+    return context.bot_data['catalog'].get()
+
+
+def get_orders(context):
+    return context.bot_data['orders']
+
+
+def get_outbound(context):
+    return context.bot_data['outbound']
+
+
+def get_render_cache(context):
+    return context.bot_data['render']
+
+
+def get_views(context):
+    return context.bot_data['views']
+
+
 def get_update_info(update):
     if update.callback_query:
         return {
@@ -0,0 +1,190 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from telegram.error import BadRequest
+
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+TEXT, PHOTO = "text", "photo"
+
+
+class View:
+    __slots__ = ("message_id", "kind", "text", "reply_markup", "photo")
+
+    def __init__(self, message_id, kind, text=None, reply_markup=None, photo=None):
+        self.message_id = message_id
+        self.kind = kind
+        self.text = text
+        self.reply_markup = reply_markup
+        self.photo = photo
+
+    @classmethod
+    def from_message(cls, message):
+        if getattr(message, "photo", None):
+            return cls(message.message_id, PHOTO, message.caption, message.reply_markup)
+        return cls(message.message_id, TEXT, message.text, message.reply_markup)
+
+
+def is_not_modified(error):
+    return "not modified" in str(error).lower()
+
+
+class ViewTracker:
+    def __init__(self, outbound, images, max_chats=10000):
+        self.outbound = outbound
+        self.images = images
+        self.max_chats = max_chats
+        self.saved = 0
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self):
+        metrics.add_collector(self.render_stats)
+        return self
+
+    def current(self, chat_id, message=None):
+        with self._lock:
+            view = self._views.get(chat_id)
+        if message is None:
+            return view
+        if view is not None and view.message_id == message.message_id:
+            return view
+        return View.from_message(message)
+
+    def send_text(self, chat_id, text, reply_markup=None):
+        sent = self.outbound.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+        self.remember(chat_id, View(sent.message_id, TEXT, text, reply_markup))
+        return sent
+
+    def send_photo(self, chat_id, url_image, caption, reply_markup=None):
+        sent = self.images.send_photo(self.outbound, chat_id, url_image, caption=caption, reply_markup=reply_markup)
+        self.remember(chat_id, View(sent.message_id, PHOTO, caption, reply_markup, url_image))
+        return sent
+
+    def show_text(self, chat_id, text, reply_markup=None, message=None):
+        current = self.current(chat_id, message) if message else None
+        if current is not None and current.kind == TEXT:
+            if current.text == text and current.reply_markup == reply_markup:
+                self.count_saved(2)
+                return
+            try:
+                if current.text == text:
+                    self.outbound.edit_message_reply_markup(
+                        chat_id=chat_id,
+                        message_id=current.message_id,
+                        reply_markup=reply_markup,
+                    )
+                else:
+                    self.outbound.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=current.message_id,
+                        text=text,
+                        reply_markup=reply_markup,
+                    )
+            except BadRequest as error:
+                if not is_not_modified(error):
+                    logger.warning(f"Не удалось изменить сообщение в чате {chat_id}, отправляем новое: {error}")
+                    return self.replace(chat_id, current, lambda: self.send_text(chat_id, text, reply_markup))
+            self.count_saved(1)
+            self.remember(chat_id, View(current.message_id, TEXT, text, reply_markup))
+            return
+        return self.replace(chat_id, current, lambda: self.send_text(chat_id, text, reply_markup))
+
+    def show_photo(self, chat_id, url_image, caption, reply_markup=None, message=None):
+        current = self.current(chat_id, message) if message else None
+        send = lambda: self.send_photo(chat_id, url_image, caption, reply_markup)
+        if current is not None and current.kind == PHOTO and current.photo == url_image:
+            if current.text == caption and current.reply_markup == reply_markup:
+                self.count_saved(2)
+                return
+            try:
+                if current.text == caption:
+                    self.outbound.edit_message_reply_markup(
+                        chat_id=chat_id,
+                        message_id=current.message_id,
+                        reply_markup=reply_markup,
+                    )
+                else:
+                    self.outbound.edit_message_caption(
+                        chat_id=chat_id,
+                        message_id=current.message_id,
+                        caption=caption,
+                        reply_markup=reply_markup,
+                    )
+            except BadRequest as error:
+                if not is_not_modified(error):
+                    logger.warning(f"Не удалось изменить сообщение в чате {chat_id}, отправляем новое: {error}")
+                    return self.replace(chat_id, current, send)
+            self.count_saved(1)
+            self.remember(chat_id, View(current.message_id, PHOTO, caption, reply_markup, url_image))
+            return
+        if current is not None and current.kind == PHOTO:
+            try:
+                self.images.edit_photo(
+                    self.outbound,
+                    chat_id,
+                    current.message_id,
+                    url_image,
+                    caption=caption,
+                    reply_markup=reply_markup,
+                )
+            except BadRequest as error:
+                logger.warning(f"Не удалось заменить фото в чате {chat_id}, отправляем новое: {error}")
+            else:
+                self.count_saved(1)
+                self.remember(chat_id, View(current.message_id, PHOTO, caption, reply_markup, url_image))
+                return
+        return self.replace(chat_id, current, send)
+
+    def show_keyboard(self, chat_id, reply_markup, message):
+        current = self.current(chat_id, message)
+        if current.reply_markup == reply_markup:
+            self.count_saved(1)
+            return
+        try:
+            self.outbound.edit_message_reply_markup(
+                chat_id=chat_id,
+                message_id=current.message_id,
+                reply_markup=reply_markup,
+            )
+        except BadRequest as error:
+            if not is_not_modified(error):
+                logger.warning(f"Не удалось изменить сообщение в чате {chat_id}, отправляем новое: {error}")
+                if current.kind == PHOTO and current.photo:
+                    send = lambda: self.send_photo(chat_id, current.photo, current.text, reply_markup)
+                else:
+                    send = lambda: self.send_text(chat_id, current.text, reply_markup)
+                return self.replace(chat_id, current, send)
+        current = View(current.message_id, current.kind, current.text, reply_markup, current.photo)
+        self.remember(chat_id, current)
+
+    def replace(self, chat_id, current, send):
+        sent = send()
+        if current is not None:
+            try:
+                self.outbound.delete_message(chat_id=chat_id, message_id=current.message_id)
+            except BadRequest as error:
+                logger.warning(f"Не удалось удалить сообщение {current.message_id} в чате {chat_id}: {error}")
+        return sent
+
+    def remember(self, chat_id, view):
+        with self._lock:
+            self._views[chat_id] = view
+            self._views.move_to_end(chat_id)
+            while len(self._views) > self.max_chats:
+                self._views.popitem(last=False)
+
+    def count_saved(self, calls):
+        with self._lock:
+            self.saved += calls
+
+    def render_stats(self):
+        with self._lock:
+            saved = self.saved
+        return [
+            "# TYPE fish_shop_telegram_calls_saved_total counter",
+            f"fish_shop_telegram_calls_saved_total {saved}",
+        ]
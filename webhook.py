@@ -0,0 +1,172 @@
+import json
+import logging
+import queue
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+
+logger = logging.getLogger(__name__)
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def get_raw_update_user_id(data):
+    for value in data.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"].get("id")
+    return None
+
+
+class UpdateWorkerPool:
+    def __init__(self, dispatcher, workers=4, queue_size=100, on_processed=None, shards=1):
+        self.dispatcher = dispatcher
+        self.on_processed = on_processed
+        self.shards = shards
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+
+    def start(self):
+        for index, updates in enumerate(self.queues):
+            thread = threading.Thread(target=self._work, args=(updates,), name=f"update-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for updates in self.queues:
+            updates.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, data):
+        user_id = get_raw_update_user_id(data)
+        key = int(user_id if user_id is not None else data.get("update_id", 0))
+        index = key // self.shards % len(self.queues)
+        try:
+            self.queues[index].put_nowait(data)
+        except queue.Full:
+            return False
+        return True
+
+    def queued(self):
+        return sum(updates.qsize() for updates in self.queues)
+
+    def _work(self, updates):
+        while True:
+            data = updates.get()
+            if data is None:
+                return
+            try:
+                self.dispatcher.process_update(Update.de_json(data, self.dispatcher.bot))
+            except Exception as error:
+                logger.exception(f"Ошибка при обработке обновления: {error}")
+            if self.on_processed:
+                self.on_processed()
+
+
+class WebhookListener:
+    def __init__(self, submit, host="127.0.0.1", port=8443, url_path="/webhook", secret_token=None):
+        self.submit = submit
+        self.url_path = url_path
+        self.secret_token = secret_token
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def serve_forever(self):
+        logger.info(f"Приём обновлений на порту {self.port}, путь {self.url_path}")
+        self._server.serve_forever()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        listener = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if self.path.split("?")[0] != listener.url_path:
+                    self._reply(404)
+                    return
+                if listener.secret_token and self.headers.get(SECRET_HEADER) != listener.secret_token:
+                    self._reply(403)
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    data = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._reply(400)
+                    return
+                if not isinstance(data, dict):
+                    self._reply(400)
+                    return
+                if not listener.submit(data):
+                    logger.warning("Очередь обновлений переполнена, обновление отклонено")
+                    self._reply(503, retry_after=1)
+                    return
+                self._reply(200)
+
+            def _reply(self, status, retry_after=None):
+                self.send_response(status)
+                if retry_after:
+                    self.send_header("Retry-After", str(retry_after))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        return WebhookHandler
+
+
+def wait_for_stop_signal():
+    stopped = threading.Event()
+
+    def stop(signum, frame):
+        logger.info(f"Получен сигнал {signal.Signals(signum).name}, остановка")
+        stopped.set()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, stop)
+    stopped.wait()
+
+
+def stop_dispatcher(dispatcher):
+    if "cart_coalescer" in dispatcher.bot_data:
+        dispatcher.bot_data["cart_coalescer"].stop()
+    if "orders" in dispatcher.bot_data:
+        dispatcher.bot_data["orders"].stop()
+    if dispatcher.persistence:
+        dispatcher.update_persistence()
+        dispatcher.persistence.flush()
+    if "strapi_session" in dispatcher.bot_data:
+        dispatcher.bot_data["strapi_session"].close()
+
+
+def run_webhook(dispatcher, host, port, url_path, webhook_url=None, secret_token=None, workers=4, queue_size=100):
+    pool = UpdateWorkerPool(dispatcher, workers=workers, queue_size=queue_size)
+    pool.start()
+    listener = WebhookListener(pool.submit, host=host, port=port, url_path=url_path, secret_token=secret_token)
+    if webhook_url:
+        dispatcher.bot.set_webhook(
+            url=f"{webhook_url.rstrip('/')}{url_path}",
+            max_connections=min(100, workers),
+            secret_token=secret_token,
+        )
+    listener.start()
+    try:
+        wait_for_stop_signal()
+        logger.info("Остановка приёма обновлений")
+    finally:
+        listener.stop()
+        pool.stop()
+        stop_dispatcher(dispatcher)